@@ -0,0 +1,154 @@
+"""
+On disk read-through cache of the jsontracadmin list output.
+
+Each environment gets its own cache directory holding one file per cached
+command and a 'stamp' file.  'set fields from config' and the ticket admin
+web panels replace the stamp, which invalidates every entry at once.  A
+lookup only reads two small files, it never opens a database connection.
+
+The ticket field trac-admin commands of Trac itself ('priority add',
+'component remove', ...) cannot replace the stamp, their changes are only
+seen once entries are older than cache_max_age seconds, hence the short
+default.
+
+Enable it in trac.ini:
+
+ [jsontracadmin]
+ cache = true
+ cache_size = 64
+ cache_max_age = 60
+"""
+
+import hashlib
+import json
+import os
+import time
+
+from ticketfieldcommon.api import CACHE_SECTION_NAME
+from ticketfieldcommon.api import STAMP_FILE
+from ticketfieldcommon.api import cache_dir
+from ticketfieldcommon.api import write_file
+from ticketfieldcommon.api import write_stamp
+
+DEFAULT_SIZE = 64
+DEFAULT_MAX_AGE = 60
+
+
+def open_cache(env):
+    """
+    Return the ListCache of an environment, or None when caching is not
+    enabled.
+    """
+    if not env.config.getbool(CACHE_SECTION_NAME, 'cache'):
+        return None
+    return ListCache(cache_dir(env),
+                     size=env.config.getint(CACHE_SECTION_NAME, 'cache_size',
+                                            DEFAULT_SIZE),
+                     max_age=env.config.getint(CACHE_SECTION_NAME,
+                                               'cache_max_age',
+                                               DEFAULT_MAX_AGE))
+
+
+def _read_file(path):
+    try:
+        with open(path, 'rb') as f:
+            return f.read().decode('utf-8')
+    except (IOError, OSError):
+        return None
+
+
+class ListCache(object):
+    """
+    A directory of cached command outputs, bounded to size entries with
+    least recently used eviction.  Entries older than max_age seconds are
+    ignored, which limits staleness after writes the stamp does not see
+    (such as 'trac-admin priority add').
+    """
+
+    def __init__(self, path, size=DEFAULT_SIZE, max_age=DEFAULT_MAX_AGE):
+        self.path = path
+        self.size = size
+        self.max_age = max_age
+
+    def _entry_path(self, key):
+        name = hashlib.sha1(key.encode('utf-8')).hexdigest() + '.json'
+        return os.path.join(self.path, name)
+
+    def stamp(self, create=False):
+        """
+        Return the current stamp, or None when there is none yet unless
+        create is set.
+        """
+        stamp = _read_file(os.path.join(self.path, STAMP_FILE))
+        if stamp is None and create:
+            self.bump()
+            stamp = _read_file(os.path.join(self.path, STAMP_FILE))
+        return stamp
+
+    def bump(self):
+        write_stamp(self.path)
+
+    def get(self, key):
+        """
+        Return the cached output for key, or None.
+        """
+        stamp = self.stamp()
+        if stamp is None:
+            return None
+
+        path = self._entry_path(key)
+        data = _read_file(path)
+        if data is None:
+            return None
+        try:
+            entry = json.loads(data)
+        except ValueError:
+            return None
+        if (entry.get('stamp') != stamp or
+                time.time() - entry.get('time', 0) > self.max_age):
+            return None
+
+        # the modification time orders the entries for eviction
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+        return entry['output']
+
+    def set(self, key, output, stamp=None):
+        """
+        Store the output for key and evict the least recently used entries
+        above the size bound.
+
+        stamp is the stamp read before output was computed.  Nothing is
+        stored when the stamp changed since, as output may predate a write
+        committed in between.  Without it the current stamp is used.
+        """
+        current = self.stamp(create=True)
+        if stamp is None:
+            stamp = current
+        elif stamp != current:
+            return False
+
+        write_file(self._entry_path(key),
+                    json.dumps({'stamp': stamp, 'time': time.time(),
+                                'key': key, 'output': output}))
+        self._evict()
+        return True
+
+    def _evict(self):
+        entries = []
+        for name in os.listdir(self.path):
+            if name.endswith('.json'):
+                path = os.path.join(self.path, name)
+                try:
+                    entries.append((os.path.getmtime(path), path))
+                except OSError:
+                    pass
+
+        entries.sort()
+        for mtime, path in entries[:max(0, len(entries) - self.size)]:
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
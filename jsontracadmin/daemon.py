@@ -0,0 +1,151 @@
+"""
+Long running server answering the jsontracadmin commands over a Unix socket.
+
+Starting trac-admin costs far more than the query behind a 'json list'
+command.  The server keeps every Trac environment it has opened (and its
+database connection pool) warm between requests:
+
+ jsontracadmin-daemon serve --socket /run/trac/json.sock
+
+and the client prints exactly what trac-admin would have printed:
+
+ jsontracadmin-daemon query --socket /run/trac/json.sock \\
+     /srv/trac/project1 priority json list
+
+A request is one JSON line {"env": path, "command": [words]} and the reply
+one JSON line holding either the command "output" or an "error".  Only the
+commands provided by JsonAdminCommandProvider can be run.
+"""
+
+import argparse
+import json
+import os
+import socket
+import sys
+
+try:
+    import socketserver
+except ImportError:
+    import SocketServer as socketserver
+
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
+
+from trac.env import open_environment
+
+from jsontracadmin.jsontracadmin import JsonAdminCommandProvider
+
+
+def run_command(env_path, words):
+    """
+    Run a JsonAdminCommandProvider command against a cached environment and
+    return what it printed.
+    """
+    env = open_environment(env_path, use_cache=True)
+    provider = JsonAdminCommandProvider(env)
+
+    for command in provider.get_admin_commands():
+        parts = command[0].split()
+        if words[:len(parts)] == parts:
+            # the commands write to sys.stdout through printout, requests
+            # are handled one at a time so it is safe to swap it
+            stdout = sys.stdout
+            sys.stdout = StringIO()
+            try:
+                command[4](*words[len(parts):])
+                return sys.stdout.getvalue()
+            finally:
+                sys.stdout = stdout
+
+    raise ValueError('Unknown command: %s' % ' '.join(words))
+
+
+class JsonRequestHandler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        try:
+            request = json.loads(self.rfile.readline().decode('utf-8'))
+            reply = {'output': run_command(request['env'],
+                                           list(request['command']))}
+        except Exception as e:
+            reply = {'error': '%s: %s' % (e.__class__.__name__, e)}
+        self.wfile.write((json.dumps(reply) + '\n').encode('utf-8'))
+
+
+def make_server(socket_path, mode=0o600):
+    """
+    Bind the server to socket_path, replacing a stale socket file, and make
+    it accessible according to mode.
+    """
+    if os.path.exists(socket_path):
+        os.unlink(socket_path)
+    server = socketserver.UnixStreamServer(socket_path, JsonRequestHandler)
+    os.chmod(socket_path, mode)
+    return server
+
+
+def query(socket_path, env_path, *words):
+    """
+    Send one command to the server and return its output.  Raises
+    RuntimeError when the server reports an error.
+    """
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        client.connect(socket_path)
+        request = {'env': env_path, 'command': list(words)}
+        client.sendall((json.dumps(request) + '\n').encode('utf-8'))
+        reply = client.makefile('rb').readline()
+    finally:
+        client.close()
+
+    reply = json.loads(reply.decode('utf-8'))
+    if 'error' in reply:
+        raise RuntimeError(reply['error'])
+    return reply['output']
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Serve jsontracadmin commands over a Unix socket.')
+    subparsers = parser.add_subparsers(dest='action')
+
+    serve = subparsers.add_parser('serve', help='run the server')
+    serve.add_argument('--socket', required=True)
+    serve.add_argument('--mode', default='600',
+                       help='octal permissions of the socket (default 600)')
+
+    client = subparsers.add_parser('query', help='run a command')
+    client.add_argument('--socket', required=True)
+    client.add_argument('env')
+    client.add_argument('command', nargs='+')
+
+    options = parser.parse_args(argv)
+
+    if options.action == 'serve':
+        server = make_server(options.socket, int(options.mode, 8))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            os.unlink(options.socket)
+        return 0
+
+    if options.action == 'query':
+        try:
+            sys.stdout.write(query(options.socket, options.env,
+                                   *options.command))
+        except (RuntimeError, socket.error) as e:
+            sys.stderr.write('%s\n' % e)
+            return 1
+        return 0
+
+    parser.print_usage()
+    return 2
+
+
+if __name__ == '__main__':
+    sys.exit(main())
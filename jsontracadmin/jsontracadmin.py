@@ -1,20 +1,46 @@
 from trac.core import *
 from trac.admin import IAdminCommandProvider
+from trac.admin.api import AdminCommandError
+from trac.web.api import IRequestFilter
 from trac.util.text import printout
 
 # needed to dumps
 import json
+import sys
 
-# import each of the panels we would like to support
-from trac.ticket.admin import PriorityAdminPanel
-from trac.ticket.admin import SeverityAdminPanel
-from trac.ticket.admin import TicketTypeAdminPanel
-from trac.ticket.admin import ResolutionAdminPanel
+try:
+    unichr
+except NameError:
+    unichr = chr
 
-# Need the following to create list of [(component,owner),...]
-from trac.ticket.model import Component as TicketComponent
+# the panels we would like to support and trac.ticket.model are imported
+# inside the commands, so other trac-admin commands do not pay for them
 from trac.util.translation import _
 
+from jsontracadmin.cache import open_cache
+from ticketfieldcommon.api import TICKET_COLUMNS
+from ticketfieldcommon.api import bump_stamp
+from ticketfieldcommon.api import select_ticket_usage
+
+# number of rows fetched and encoded at a time by the streaming list output
+STREAM_CHUNK_SIZE = 1000
+
+# enum.type of the ticket fields listed by 'fields json dump'
+ENUM_TYPES = ('priority', 'severity', 'resolution', 'ticket_type')
+
+def _prefix_successor(prefix):
+    # the smallest string greater than every string starting with prefix,
+    # or None when there is none
+    prefix = prefix.rstrip(unichr(sys.maxunicode))
+    if not prefix:
+        return None
+    code = ord(prefix[-1]) + 1
+    if 0xD800 <= code <= 0xDFFF:
+        # skip the surrogates, databases refuse them in strings
+        code = 0xE000
+    return prefix[:-1] + unichr(code)
+
+
 class JsonAdminCommandProvider(Component):
     implements(IAdminCommandProvider)
     
@@ -24,43 +50,316 @@ class JsonAdminCommandProvider(Component):
         #yield ('command regex', '<arg>',
         #       'trac-admin help text',
         #       self.tab_complete_callback, self.command_callback)
-        yield ('priority json list', '',
+        yield ('priority json list', '[--ndjson|--stream]',
                'Show possible ticket priorities in json',
                None, self.list_priority_in_json)
-        yield ('severity json list', '',
+        yield ('severity json list', '[--ndjson|--stream]',
                'Show possible ticket severities in json',
                None, self.list_severity_in_json)
-        yield ('resolution json list', '',
+        yield ('resolution json list', '[--ndjson|--stream]',
                'Show possible ticket resolutions in json',
                None, self.list_resolution_in_json)
-        yield ('ticket_type json list', '',
+        yield ('ticket_type json list', '[--ndjson|--stream]',
                'Show possible ticket types in json',
                None, self.list_ticket_type_in_json)
-        yield ('component json list', '',
-               'Show available components in json',
+        yield ('component json list',
+               '[--ndjson|--stream] [--prefix <prefix>] [--limit <n>] '
+               '[--after <name>]',
+               """Show available components in json
+
+               --ndjson writes one json object per line and --stream writes
+               a json array incrementally, both read the rows one page of
+               a query at a time so memory stays flat for very long lists.
+
+               --prefix lists only the components whose name starts with
+               prefix, --limit returns at most n of them and --after
+               starts after the given name.  With any of these a json
+               object is written, holding the "components" and the "next"
+               name to pass to --after for the following page (null on the
+               last page).  --limit cannot be combined with --ndjson or
+               --stream.""",
                None, self.list_component_in_json)
+        yield ('fields json dump', '',
+               'Show all ticket field options in one json document',
+               None, self.dump_fields_in_json)
+        yield ('fields json usage', '',
+               'Show the number of tickets using each ticket field option',
+               None, self.list_usage_in_json)
 
     # the following methods list various enums in json
 
-    def list_priority_in_json(self):
-        panel = PriorityAdminPanel(self.env)
-        printout(json.dumps(panel.get_enum_list()))
+    def list_priority_in_json(self, *args):
+        if args:
+            return self._stream_enum_in_json('priority', args)
+        printout(self._cached_json('priority json list',
+                                   self._get_enum_list, 'PriorityAdminPanel'))
      
-    def list_severity_in_json(self):
-        panel = SeverityAdminPanel(self.env)
-        printout(json.dumps(panel.get_enum_list()))
+    def list_severity_in_json(self, *args):
+        if args:
+            return self._stream_enum_in_json('severity', args)
+        printout(self._cached_json('severity json list',
+                                   self._get_enum_list, 'SeverityAdminPanel'))
      
-    def list_resolution_in_json(self):
-        panel = ResolutionAdminPanel(self.env)
-        printout(json.dumps(panel.get_enum_list()))
+    def list_resolution_in_json(self, *args):
+        if args:
+            return self._stream_enum_in_json('resolution', args)
+        printout(self._cached_json('resolution json list',
+                                   self._get_enum_list, 'ResolutionAdminPanel'))
      
-    def list_ticket_type_in_json(self):
-        panel = TicketTypeAdminPanel(self.env)
-        printout(json.dumps(panel.get_enum_list()))
+    def list_ticket_type_in_json(self, *args):
+        if args:
+            return self._stream_enum_in_json('ticket_type', args)
+        printout(self._cached_json('ticket_type json list',
+                                   self._get_enum_list, 'TicketTypeAdminPanel'))
      
-    def list_component_in_json(self):
+    def list_component_in_json(self, *args):
+        mode, options = self._parse_component_options(args)
+        if mode:
+            def page_query(db, last):
+                page_options = dict(options, after=last[0]) if last else \
+                               options
+                return self._component_query(page_options, STREAM_CHUNK_SIZE)
+            rows = self._iter_pages(page_query)
+            return self._stream_json(
+                ({'name':name,'owner':owner} for name, owner in rows), [mode])
+        if options:
+            printout(json.dumps(self._get_component_page(options)))
+            return
+        printout(self._cached_json('component json list',
+                                   self._get_component_list))
+
+    def _parse_component_options(self, args):
+        # returns the --ndjson/--stream switch, or None, and a dict of the
+        # prefix, limit and after options given
+        args = list(args)
+        mode = None
+        options = {}
+        while args:
+            arg = args.pop(0)
+            if arg in ('--ndjson', '--stream') and mode is None:
+                mode = arg
+            elif (arg in ('--prefix', '--limit', '--after') and args and
+                    arg[2:] not in options):
+                options[arg[2:]] = args.pop(0)
+            else:
+                raise AdminCommandError(_("Invalid arguments"),
+                                        show_usage=True)
+
+        if 'limit' in options:
+            if mode is not None:
+                raise AdminCommandError(_("--limit cannot be streamed"),
+                                        show_usage=True)
+            try:
+                options['limit'] = int(options['limit'])
+            except ValueError:
+                options['limit'] = 0
+            if options['limit'] < 1:
+                raise AdminCommandError(_("Invalid --limit"),
+                                        show_usage=True)
+        return mode, options
+
+    def _component_query(self, options, limit=None):
+        # the keyset cursor is a range condition on the primary key.  The
+        # prefix is matched exactly with prefix_match(), and where names
+        # are compared by code point (SQLite, PostgreSQL with the C
+        # collation) a range on the primary key is added too, as a hint
+        # for the index.  Other collations ignore punctuation or case, so
+        # there the range would not mean "starts with".
+        where = []
+        params = []
+        if options.get('prefix'):
+            with self.env.db_query as db:
+                where.append('name ' + db.prefix_match())
+                params.append(db.prefix_match_value(options['prefix']))
+                successor = _prefix_successor(options['prefix'])
+                if self._orders_by_code_point(db):
+                    where.append('name >= %s')
+                    params.append(options['prefix'])
+                    if successor is not None:
+                        where.append('name < %s')
+                        params.append(successor)
+        if 'after' in options:
+            where.append('name > %s')
+            params.append(options['after'])
+        query = 'SELECT name, owner FROM component'
+        if where:
+            query += ' WHERE ' + ' AND '.join(where)
+        query += ' ORDER BY name'
+        if limit is not None:
+            query += ' LIMIT %d' % limit
+        return query, params
+
+    def _orders_by_code_point(self, db):
+        # whether the database compares names code point by code point,
+        # asked once per environment for PostgreSQL
+        scheme = self.env.config.get('trac', 'database').split(':', 1)[0]
+        if scheme == 'sqlite':
+            return True
+        if scheme != 'postgres':
+            return False
+        if getattr(self, '_code_point_collation', None) is None:
+            for collation, in db("""
+                    SELECT datcollate FROM pg_database
+                    WHERE datname=current_database()
+                    """):
+                self._code_point_collation = collation in ('C', 'POSIX')
+        return bool(getattr(self, '_code_point_collation', False))
+
+    def _get_component_page(self, options):
+        # one extra row tells whether there is a next page
+        query, params = self._component_query(
+            options, options['limit'] + 1 if 'limit' in options else None)
+        rows = list(self.env.db_query(query, params))
+
+        next_name = None
+        if 'limit' in options and len(rows) > options['limit']:
+            rows = rows[:options['limit']]
+            next_name = rows[-1][0]
+        return {'components': [{'name':name,'owner':owner}
+                               for name, owner in rows],
+                'next': next_name}
+
+    def _get_enum_list(self, panel_name):
+        # import each of the panels we would like to support on first use
+        from trac.ticket import admin
+        panel = getattr(admin, panel_name)(self.env)
+        return panel.get_enum_list()
+
+    def _get_component_list(self):
+        # Need the following to create list of [(component,owner),...]
+        from trac.ticket.model import Component as TicketComponent
         # stolen from trac.ticket.admin.py format: [(component,owner)]
         #components = [(c.name, c.owner) for c in TicketComponent.select(self.env)], [_('Name'), _('Owner')]
-        components = [{'name':c.name,'owner':c.owner} for c in TicketComponent.select(self.env)]
-        printout(json.dumps(components))
-   
+        return [{'name':c.name,'owner':c.owner} for c in TicketComponent.select(self.env)]
+
+    def _cached_json(self, key, compute, *args):
+        # read-through the on disk cache when it is enabled, a hit only
+        # reads the cache files and never opens a database connection
+        cache = open_cache(self.env)
+        if cache is not None:
+            output = cache.get(key)
+            if output is not None:
+                return output
+            # read before computing, a list computed while an apply
+            # commits must not be stored under the stamp it bumped
+            stamp = cache.stamp(create=True)
+
+        output = json.dumps(compute(*args))
+        if cache is not None:
+            cache.set(key, output, stamp)
+        return output
+
+    # the following methods stream list output chunk by chunk
+
+    def _stream_enum_in_json(self, enum_type, args):
+        def page_query(db, last):
+            # keyset on (position, name), positions are not unique
+            position = db.cast('value', 'int')
+            query = "SELECT name, %s FROM enum WHERE type=%%s" % position
+            params = [enum_type]
+            if last is not None:
+                query += " AND (%s > %%s OR (%s = %%s AND name > %%s))" % (
+                    position, position)
+                params.extend((last[1], last[1], last[0]))
+            query += " ORDER BY %s, name LIMIT %d" % (position,
+                                                     STREAM_CHUNK_SIZE)
+            return query, params
+        rows = self._iter_pages(page_query)
+        self._stream_json((name for name, position in rows), args)
+
+    def _iter_pages(self, page_query):
+        # read STREAM_CHUNK_SIZE rows at a time, each page is a query of
+        # its own continuing after the last row of the previous one.
+        # Cursors are no help, Trac's SQLite EagerCursor and psycopg2's
+        # client side cursors both hold the whole result in memory.
+        last = None
+        while True:
+            with self.env.db_query as db:
+                query, params = page_query(db, last)
+                rows = db(query, params)
+            for row in rows:
+                yield row
+            if len(rows) < STREAM_CHUNK_SIZE:
+                return
+            last = rows[-1]
+
+    def _stream_json(self, items, args):
+        if list(args) not in (['--ndjson'], ['--stream']):
+            raise AdminCommandError(_("Invalid arguments"), show_usage=True)
+        ndjson = args[0] == '--ndjson'
+
+        chunk = []
+        first = True
+        if not ndjson:
+            printout('[', newline=False)
+        for item in items:
+            chunk.append(json.dumps(item))
+            if len(chunk) == STREAM_CHUNK_SIZE:
+                self._write_chunk(chunk, ndjson, first)
+                chunk = []
+                first = False
+        if chunk:
+            self._write_chunk(chunk, ndjson, first)
+        if not ndjson:
+            printout(']')
+
+    def _write_chunk(self, chunk, ndjson, first):
+        if ndjson:
+            printout('\n'.join(chunk))
+        else:
+            printout(('' if first else ',') + ','.join(chunk), newline=False)
+        sys.stdout.flush()
+
+    def dump_fields_in_json(self):
+        printout(self._cached_json('fields json dump', self._get_fields))
+
+    def _get_fields(self):
+        # one query for every enum type and one for the components
+        fields = dict((enum_type, []) for enum_type in ENUM_TYPES)
+        with self.env.db_query as db:
+            for enum_type, name in db("""
+                    SELECT type, name FROM enum WHERE type IN (%s,%s,%s,%s)
+                    ORDER BY type, """ + db.cast('value', 'int'),
+                    ENUM_TYPES):
+                fields[enum_type].append(name)
+            fields['component'] = [{'name':name,'owner':owner}
+                for name, owner in db("""
+                    SELECT name, owner FROM component ORDER BY name""")]
+        return fields
+
+    def list_usage_in_json(self):
+        # counts come from one GROUP BY query per field, values which are
+        # defined but not used by any ticket are listed with a count of 0
+        with self.env.db_query as db:
+            usage = select_ticket_usage(db, TICKET_COLUMNS)
+            for enum_type, name in db("""
+                    SELECT type, name FROM enum WHERE type IN (%s,%s,%s,%s)
+                    """, ENUM_TYPES):
+                usage[enum_type].setdefault(name, 0)
+            for table in ('component', 'milestone', 'version'):
+                for name, in db("SELECT name FROM %s" % table):
+                    usage[table].setdefault(name, 0)
+        printout(json.dumps(usage))
+
+
+class ListCacheInvalidator(Component):
+    """
+    Invalidate the cached json lists whenever one of the ticket admin
+    panels (priorities, components, ...) is submitted.
+    """
+    implements(IRequestFilter)
+
+    # IRequestFilter methods
+
+    def pre_process_request(self, req, handler):
+        if req.method == 'POST' and req.path_info.startswith('/admin/ticket/'):
+            bump_stamp(self.env)
+            # the panels redirect once their change is committed, bump
+            # again so a list cached in between is not kept
+            req.add_redirect_listener(
+                lambda req, url, permanent: bump_stamp(self.env))
+        return handler
+
+    def post_process_request(self, req, template, data, *args):
+        return (template, data) + args
+
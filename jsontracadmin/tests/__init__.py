@@ -0,0 +1,3 @@
+from .daemontests import *
+from .cachetests import *
+from .jsontracadmintests import *
@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
+
+from trac.test import EnvironmentStub
+
+from jsontracadmin.cache import ListCache
+from jsontracadmin.cache import open_cache
+from jsontracadmin.jsontracadmin import JsonAdminCommandProvider
+from ticketfieldconfig import TicketFieldConfigCommand
+
+class ListCacheTests(unittest.TestCase):
+
+    def setUp(self):
+        """Create a Trac env with the list cache enabled"""
+        self.env = EnvironmentStub(default_data=True,
+                                   path=tempfile.mkdtemp())
+        self.env.config.set('jsontracadmin', 'cache', 'true')
+        self.provider = JsonAdminCommandProvider(self.env)
+
+    def tearDown(self):
+        shutil.rmtree(self.env.path)
+
+    def _run(self, command):
+        stdout = sys.stdout
+        sys.stdout = StringIO()
+        try:
+            command()
+            return json.loads(sys.stdout.getvalue())
+        finally:
+            sys.stdout = stdout
+
+    def test_warm_cache_does_not_query_database(self):
+        """a cached list is answered without a database connection"""
+        expected = self._run(self.provider.list_priority_in_json)
+
+        class NoDatabase(self.env.__class__):
+            @property
+            def db_query(self):
+                raise AssertionError('database used')
+        self.env.__class__ = NoDatabase
+
+        self.assertEqual(self._run(self.provider.list_priority_in_json),
+                         expected)
+
+    def test_apply_invalidates_cache(self):
+        """set fields from config invalidates the cached lists"""
+        self._run(self.provider.list_priority_in_json)
+
+        self.env.config.set('ticket-field-config', 'priority', 'P1,P2')
+        TicketFieldConfigCommand(self.env).apply_fields_from_config()
+
+        self.assertEqual(self._run(self.provider.list_priority_in_json),
+                         ['P1', 'P2'])
+
+    def test_list_computed_during_apply_not_cached(self):
+        """
+        a list computed before an apply committed is not stored under the
+        stamp the apply bumped
+        """
+        self.env.config.set('ticket-field-config', 'priority', 'P1,P2')
+        get_enum_list = self.provider._get_enum_list
+        def apply_while_computing(panel_name):
+            enums = get_enum_list(panel_name)
+            TicketFieldConfigCommand(self.env).apply_fields_from_config()
+            return enums
+        self.provider._get_enum_list = apply_while_computing
+
+        self.assertNotEqual(self._run(self.provider.list_priority_in_json),
+                            ['P1', 'P2'])
+        del self.provider._get_enum_list
+        self.assertEqual(self._run(self.provider.list_priority_in_json),
+                         ['P1', 'P2'])
+
+    def test_lru_eviction(self):
+        """the least recently used entries are evicted above the bound"""
+        cache = ListCache(os.path.join(self.env.path, 'lru'), size=2)
+        cache.set('a', '1')
+        cache.set('b', '2')
+        os.utime(cache._entry_path('a'), (0, 0))
+        os.utime(cache._entry_path('b'), (1, 1))
+        self.assertEqual(cache.get('a'), '1')   # a is now the most recent
+        cache.set('c', '3')
+
+        self.assertEqual(cache.get('a'), '1')
+        self.assertEqual(cache.get('b'), None)
+        self.assertEqual(cache.get('c'), '3')
+
+    def test_default_max_age_is_short(self):
+        """
+        writes the stamp does not see, such as trac-admin priority add, are
+        picked up after a minute by default
+        """
+        cache = open_cache(self.env)
+        cache.set('a', '1')
+        path = cache._entry_path('a')
+        with open(path) as f:
+            entry = json.load(f)
+        entry['time'] -= 61
+        with open(path, 'w') as f:
+            json.dump(entry, f)
+
+        self.assertEqual(cache.get('a'), None)
@@ -0,0 +1,59 @@
+#!/usr/bin/env python
+
+import json
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from trac.env import Environment
+
+from jsontracadmin import daemon
+
+class DaemonTests(unittest.TestCase):
+
+    def setUp(self):
+        """Create a Trac environment and serve it on a Unix socket"""
+        self.dir = tempfile.mkdtemp()
+        self.env_path = os.path.join(self.dir, 'env')
+        Environment(self.env_path, create=True)
+
+        self.socket = os.path.join(self.dir, 'json.sock')
+        self.server = daemon.make_server(self.socket)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+        shutil.rmtree(self.dir)
+
+    def test_socket_is_private(self):
+        """the socket is only accessible by its owner by default"""
+        self.assertEqual(os.stat(self.socket).st_mode & 0o777, 0o600)
+
+    def test_query_matches_command_output(self):
+        """the server answers with the json the command prints"""
+        output = daemon.query(self.socket, self.env_path,
+                              'priority', 'json', 'list')
+        self.assertEqual(json.loads(output),
+                         ['blocker', 'critical', 'major', 'minor', 'trivial'])
+
+        output = daemon.query(self.socket, self.env_path,
+                              'component', 'json', 'list')
+        self.assertEqual(json.loads(output),
+                         [{'name': 'component1', 'owner': 'somebody'},
+                          {'name': 'component2', 'owner': 'somebody'}])
+
+    def test_only_json_commands_are_served(self):
+        """commands not provided by jsontracadmin are refused"""
+        self.assertRaises(RuntimeError, daemon.query, self.socket,
+                          self.env_path, 'permission', 'list')
+
+    def test_missing_environment_is_error(self):
+        """an environment that cannot be opened is reported as an error"""
+        self.assertRaises(RuntimeError, daemon.query, self.socket,
+                          os.path.join(self.dir, 'missing'),
+                          'priority', 'json', 'list')
@@ -0,0 +1,269 @@
+#!/usr/bin/env python
+
+import json
+import sys
+import unittest
+
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
+
+try:
+    unichr
+except NameError:
+    unichr = chr
+
+from trac.admin.api import AdminCommandError
+from trac.test import EnvironmentStub
+
+from jsontracadmin.jsontracadmin import JsonAdminCommandProvider
+from jsontracadmin.jsontracadmin import STREAM_CHUNK_SIZE
+
+class ComponentPageTests(unittest.TestCase):
+
+    def setUp(self):
+        """Create a Trac env holding a few hierarchical components"""
+        self.env = EnvironmentStub(default_data=True)
+        self.env.db_transaction.executemany(
+            "INSERT INTO component (name, owner) VALUES (%s,%s)",
+            [('webapp/%s' % name, 'web') for name in ('blog', 'shop', 'www')] +
+            [('webapp_old', 'old'), ('iphone/buttons', 'ios')])
+        self.provider = JsonAdminCommandProvider(self.env)
+
+    def _list(self, *args):
+        stdout = sys.stdout
+        sys.stdout = StringIO()
+        try:
+            self.provider.list_component_in_json(*args)
+            return sys.stdout.getvalue()
+        finally:
+            sys.stdout = stdout
+
+    def test_prefix(self):
+        """only the components below the prefix are listed"""
+        page = json.loads(self._list('--prefix', 'webapp/'))
+        self.assertEqual(page['components'],
+                         [{'name': 'webapp/blog', 'owner': 'web'},
+                          {'name': 'webapp/shop', 'owner': 'web'},
+                          {'name': 'webapp/www', 'owner': 'web'}])
+        self.assertEqual(page['next'], None)
+
+    def test_pages(self):
+        """following the next cursor walks the subtree page by page"""
+        names = []
+        args = ['--prefix', 'webapp/', '--limit', '2']
+        page = json.loads(self._list(*args))
+        while True:
+            names.extend(c['name'] for c in page['components'])
+            if page['next'] is None:
+                break
+            page = json.loads(self._list(*args + ['--after', page['next']]))
+
+        self.assertEqual(names, ['webapp/blog', 'webapp/shop', 'webapp/www'])
+
+    def test_prefix_is_literal(self):
+        """wildcard characters in the prefix match themselves"""
+        page = json.loads(self._list('--prefix', 'webapp_'))
+        self.assertEqual([c['name'] for c in page['components']],
+                         ['webapp_old'])
+        page = json.loads(self._list('--prefix', 'webapp*'))
+        self.assertEqual(page['components'], [])
+
+    def test_prefix_range_hint(self):
+        """
+        the prefix is matched with prefix_match(), SQLite compares by code
+        point so a primary key range is added as a hint, and other
+        databases get no range
+        """
+        query, params = self.provider._component_query({'prefix': 'webapp/'})
+        self.assertIn('GLOB', query)
+        self.assertEqual(params, ['webapp/*', 'webapp/', 'webapp0'])
+
+        last = unichr(sys.maxunicode)
+        query, params = self.provider._component_query({'prefix': last})
+        self.assertEqual(params[1:], [last])
+
+        self.env.config.set('trac', 'database', 'mysql://trac@localhost/trac')
+        self.assertFalse(self.provider._orders_by_code_point(None))
+
+    def test_streamed_prefix(self):
+        """the prefix also applies to the streamed output"""
+        lines = self._list('--ndjson', '--prefix', 'iphone/').splitlines()
+        self.assertEqual([json.loads(line) for line in lines],
+                         [{'name': 'iphone/buttons', 'owner': 'ios'}])
+
+    def test_invalid_options(self):
+        """bad limits, streamed limits and unknown options are refused"""
+        for args in (('--limit', '0'), ('--limit', 'x'),
+                     ('--stream', '--limit', '2'), ('--prefix',),
+                     ('--owner', 'web')):
+            self.assertRaises(AdminCommandError, self._list, *args)
+
+
+class FieldsDumpTests(unittest.TestCase):
+
+    def setUp(self):
+        """Create a Trac env with the default ticket field values"""
+        self.env = EnvironmentStub(default_data=True)
+        self.provider = JsonAdminCommandProvider(self.env)
+
+    def _printed(self, command, *args):
+        stdout = sys.stdout
+        sys.stdout = StringIO()
+        try:
+            command(*args)
+            return sys.stdout.getvalue()
+        finally:
+            sys.stdout = stdout
+
+    def _count_statements(self, command, *args):
+        from trac.db.util import IterableCursor
+        statements = []
+        execute = IterableCursor.execute
+        def counted_execute(cursor, *args, **kwargs):
+            statements.append(args[0])
+            return execute(cursor, *args, **kwargs)
+        IterableCursor.execute = counted_execute
+        try:
+            output = self._printed(command, *args)
+        finally:
+            IterableCursor.execute = execute
+        return output, statements
+
+    def test_dump_shape_and_queries(self):
+        """
+        the dump lists every enum field in order and the components with
+        their owner, read with one query for the enums and one for the
+        components
+        """
+        output, statements = self._count_statements(
+            self.provider.dump_fields_in_json)
+
+        self.assertEqual(json.loads(output), {
+            'priority': ['blocker', 'critical', 'major', 'minor', 'trivial'],
+            'severity': [],
+            'resolution': ['fixed', 'invalid', 'wontfix', 'duplicate',
+                           'worksforme'],
+            'ticket_type': ['defect', 'enhancement', 'task'],
+            'component': [{'name': 'component1', 'owner': 'somebody'},
+                          {'name': 'component2', 'owner': 'somebody'}],
+        })
+        self.assertEqual(len(statements), 2)
+
+    def test_stream_empty_list(self):
+        """an empty list streams as a valid empty json array"""
+        output = self._printed(self.provider.list_severity_in_json,
+                               '--stream')
+        self.assertEqual(json.loads(output), [])
+        self.assertEqual(self._printed(self.provider.list_severity_in_json,
+                                       '--ndjson'), '')
+
+    def test_stream_enum_in_order(self):
+        """a streamed enum keeps the order of the values"""
+        output = self._printed(self.provider.list_priority_in_json,
+                               '--stream')
+        self.assertEqual(json.loads(output),
+                         json.loads(self._printed(
+                             self.provider.list_priority_in_json)))
+
+    def test_stream_more_than_one_chunk(self):
+        """
+        a list longer than a chunk streams as one valid json array, and as
+        one object per line
+        """
+        names = ['component%05d' % i for i in range(STREAM_CHUNK_SIZE + 5)]
+        with self.env.db_transaction as db:
+            db("DELETE FROM component")
+            db.executemany("INSERT INTO component (name, owner) "
+                           "VALUES (%s,%s)", [(name, 'x') for name in names])
+
+        output = self._printed(self.provider.list_component_in_json,
+                               '--stream')
+        self.assertEqual([c['name'] for c in json.loads(output)], names)
+
+        lines = self._printed(self.provider.list_component_in_json,
+                              '--ndjson').splitlines()
+        self.assertEqual([json.loads(line)['name'] for line in lines], names)
+
+    def test_stream_enum_across_pages(self):
+        """
+        enums longer than a chunk, with positions shared by several values,
+        stream every value once in position order
+        """
+        names = ['P%05d' % i for i in range(STREAM_CHUNK_SIZE + 5)]
+        with self.env.db_transaction as db:
+            db("DELETE FROM enum WHERE type='priority'")
+            db.executemany("INSERT INTO enum (type, name, value) "
+                           "VALUES ('priority',%s,%s)",
+                           [(name, str(i // 2 + 1))
+                            for i, name in enumerate(names)])
+
+        output = self._printed(self.provider.list_priority_in_json,
+                               '--stream')
+        self.assertEqual(json.loads(output), names)
+
+    def test_stream_memory_is_bounded(self):
+        """
+        streaming reads one chunk at a time, so the peak memory does not
+        grow with the number of components
+        """
+        try:
+            import tracemalloc
+        except ImportError:
+            self.skipTest('tracemalloc needs Python 3')
+
+        class Discard(object):
+            encoding = 'utf-8'
+            def write(self, data):
+                pass
+            def flush(self):
+                pass
+
+        def peak(count):
+            with self.env.db_transaction as db:
+                db("DELETE FROM component")
+                db.executemany("INSERT INTO component (name, owner) "
+                               "VALUES (%s,%s)",
+                               [('component%06d' % i, 'owner%06d' % i)
+                                for i in range(count)])
+            stdout = sys.stdout
+            sys.stdout = Discard()
+            tracemalloc.start()
+            try:
+                self.provider.list_component_in_json('--ndjson')
+                return tracemalloc.get_traced_memory()[1]
+            finally:
+                tracemalloc.stop()
+                sys.stdout = stdout
+
+        small = peak(STREAM_CHUNK_SIZE * 2)
+        large = peak(STREAM_CHUNK_SIZE * 20)
+        self.assertLess(large, small * 1.5)
+
+    def test_usage_counts(self):
+        """
+        every defined value is listed with the number of tickets using it,
+        zero for unused ones, and values only used by tickets too
+        """
+        with self.env.db_transaction as db:
+            db.executemany("""
+                INSERT INTO ticket (id, time, changetime, priority,
+                                    component, milestone)
+                VALUES (%s,0,0,%s,%s,%s)
+                """, [(1, 'major', 'component1', 'milestone1'),
+                      (2, 'major', 'component1', None),
+                      (3, 'P9', None, None)])
+
+        usage = json.loads(self._printed(self.provider.list_usage_in_json))
+
+        self.assertEqual(usage['priority'],
+                         {'blocker': 0, 'critical': 0, 'major': 2,
+                          'minor': 0, 'trivial': 0, 'P9': 1})
+        self.assertEqual(usage['component'],
+                         {'component1': 2, 'component2': 0})
+        self.assertEqual(usage['milestone'],
+                         {'milestone1': 1, 'milestone2': 0,
+                          'milestone3': 0, 'milestone4': 0})
+        self.assertEqual(usage['version'], {'1.0': 0, '2.0': 0})
+        self.assertEqual(usage['severity'], {})
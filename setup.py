@@ -9,6 +9,10 @@ setup(
             'ticketfieldconfig = ticketfieldconfig',
             'jsontracadmin = jsontracadmin.jsontracadmin',
         ],
+        'console_scripts': [
+            'trac-field-config-fleet = ticketfieldconfig.fleet:main',
+            'jsontracadmin-daemon = jsontracadmin.daemon:main',
+        ],
     },
 )
 
@@ -0,0 +1,4 @@
+"""
+Helpers shared by the ticketfieldconfig and jsontracadmin plugins, so that
+neither plugin imports the internals of the other.
+"""
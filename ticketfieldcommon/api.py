@@ -0,0 +1,95 @@
+"""
+What the ticketfieldconfig and jsontracadmin plugins both need to know:
+
+ * the stamp file invalidating the jsontracadmin list cache, replaced by
+   everything that writes the ticket field tables
+ * where each ticket field is stored on tickets, and the per value ticket
+   counts built from that
+"""
+
+import os
+import tempfile
+import uuid
+
+CACHE_SECTION_NAME = 'jsontracadmin'
+STAMP_FILE = 'stamp'
+DEFAULT_CACHE_DIR = os.path.join('cache', 'jsontracadmin')
+
+# ticket table column holding the value of each field
+TICKET_COLUMNS = {
+    'priority': 'priority',
+    'severity': 'severity',
+    'resolution': 'resolution',
+    'ticket_type': 'type',
+    'component': 'component',
+    'milestone': 'milestone',
+    'version': 'version',
+}
+
+# prefix of the [ticket-custom] fields, whose values are stored by ticket in
+# ticket_custom instead of a column of the ticket table
+CUSTOM_PREFIX = 'custom.'
+
+
+def cache_dir(env):
+    """
+    Return the list cache directory of an environment, cache_dir in the
+    [jsontracadmin] section, relative to the environment directory.
+    """
+    path = (env.config.get(CACHE_SECTION_NAME, 'cache_dir') or
+            DEFAULT_CACHE_DIR)
+    return os.path.join(env.path, path)
+
+
+def write_file(path, data):
+    """
+    Write data to path through a temporary file, so readers never see
+    partial data.
+    """
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path))
+    try:
+        os.write(fd, data.encode('utf-8'))
+    finally:
+        os.close(fd)
+    os.rename(tmp, path)
+
+
+def write_stamp(directory):
+    """
+    Replace the stamp in a cache directory, invalidating every entry.
+    """
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    write_file(os.path.join(directory, STAMP_FILE), uuid.uuid4().hex)
+
+
+def bump_stamp(env):
+    """
+    Invalidate every cached list of an environment.  Does nothing for
+    environments which never used the cache.
+    """
+    path = cache_dir(env)
+    if os.path.isdir(path):
+        write_stamp(path)
+
+
+def select_ticket_usage(db, field_names):
+    """
+    Return a dictionary of {value: ticket count} for each of the given
+    fields, counted by the database with one GROUP BY query per field.
+    """
+    usage = {}
+    for field_name in field_names:
+        if field_name.startswith(CUSTOM_PREFIX):
+            usage[field_name] = dict(
+                (value, count) for value, count in db("""
+                    SELECT value, COUNT(*) FROM ticket_custom WHERE name=%s
+                    GROUP BY value
+                    """, (field_name[len(CUSTOM_PREFIX):],)) if value)
+            continue
+        column = TICKET_COLUMNS[field_name]
+        usage[field_name] = dict(
+            (value, count) for value, count in db("""
+                SELECT %s, COUNT(*) FROM ticket GROUP BY %s
+                """ % (column, column)) if value)
+    return usage
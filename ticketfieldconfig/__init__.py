@@ -2,18 +2,55 @@ from trac.core import TracError
 from trac.core import Component
 from trac.core import implements
 from trac.admin import IAdminCommandProvider
-
-from trac.ticket.admin import PriorityAdminPanel
-from trac.ticket.admin import SeverityAdminPanel
-from trac.ticket.admin import ResolutionAdminPanel
-from trac.ticket.admin import TicketTypeAdminPanel
-from trac.ticket.admin import ComponentAdminPanel
+from trac.admin.api import AdminCommandError
 
 # Trac suggests using printout over print
+from trac.util.text import printerr
 from trac.util.text import printout
 
 import json
 
+from ticketfieldcommon.api import CUSTOM_PREFIX
+from ticketfieldcommon.api import bump_stamp
+from ticketfieldcommon.api import select_ticket_usage
+
+from .fingerprint import config_digest
+from .fingerprint import field_digest
+from .fingerprint import fingerprint
+from .fingerprint import read_fingerprint
+from .fingerprint import table_stamp
+from .fingerprint import write_fingerprint
+from .lock import env_lock
+from .snapshot import list_snapshots
+from .snapshot import read_snapshot
+from .snapshot import restore_snapshot
+from .snapshot import snapshot_dir
+from .snapshot import snapshot_keep
+from .snapshot import take_snapshot
+from .snapshot import write_snapshot
+from .sources import file_digest
+from .sources import read_field_file
+from .sync import DATE_COLUMNS
+from .sync import FieldChanges
+from .sync import StatementCounter
+from .sync import date_to_timestamp
+from .sync import declared_attributes
+from .sync import delete_enums
+from .sync import delete_named
+from .sync import insert_components
+from .sync import insert_dated
+from .sync import insert_enums
+from .sync import remap_tickets
+from .sync import rename_enum
+from .sync import rename_named
+from .sync import select_component_rows
+from .sync import select_dated_rows
+from .sync import select_enum_rows
+from .sync import update_column
+from .sync import update_dates
+from .sync import update_enum_positions
+from .watch import ConfigWatcher
+
 
 class TicketFieldConfigCommand(Component):
     """
@@ -36,48 +73,500 @@ class TicketFieldConfigCommand(Component):
     COMPONENT_FIELD_NAME = 'component'
     COMPONENT_OWNER_FIELD = 'component_owner'
     SECTION_NAME = 'ticket-field-config'
+    RENAME_SUFFIX = '_rename'
+    FILE_SUFFIX = '_file'
+
+    # name of the trac.ticket.admin panel class managing each field
+    FIELD_PANELS = {
+        'priority': 'PriorityAdminPanel',
+        'severity': 'SeverityAdminPanel',
+        'resolution': 'ResolutionAdminPanel',
+        'ticket_type': 'TicketTypeAdminPanel',
+        'component': 'ComponentAdminPanel',
+        'milestone': 'MilestoneAdminPanel',
+        'version': 'VersionAdminPanel',
+    }
+
+    # fields stored in a table of their own, by name, instead of the ordered
+    # enum table
+    TABLE_FIELDS = ('component', 'milestone', 'version')
+
+    # custom fields whose '<field>.options' are set by 'custom.<field>'
+    CUSTOM_SECTION = 'ticket-custom'
+    CUSTOM_TYPES = ('select', 'radio')
 
     def __init__(self):
-        self.panels = {
-           'priority': PriorityAdminPanel(self.env),
-           'severity': SeverityAdminPanel(self.env),
-           'resolution': ResolutionAdminPanel(self.env),
-           'ticket_type': TicketTypeAdminPanel(self.env),
-           'component': ComponentAdminPanel(self.env),
-         }
+        # admin panels by field name, see get_panel()
+        self.panels = {}
 
     def get_admin_commands(self):
         """
         We have to implement get_admin_commands in order to expose the
         functionality of this plugin through the Trac admin tool.
         """
-        yield ('set fields from config', None,
+        yield ('set fields from config',
+               '[--force] [--plan] [--watch] [--profile] [--refuse-if-used]',
                """set all option values from configuration (trac.ini)
 
-               priority, severity, resolution, ticket_type, and component""",
+               priority, severity, resolution, ticket_type, component,
+               milestone and version, and the options of [ticket-custom]
+               select and radio fields
+
+               Runs are skipped when neither the configuration nor the
+               ticket field tables changed since the last apply, --force
+               applies the configuration regardless.  --plan prints the
+               changes that would be made without writing anything.
+               --profile adds the wall time and SQL statement count of
+               each field and phase to the output.  --refuse-if-used fails
+               without writing anything when a value to remove is still
+               used by tickets.  --watch keeps running and re-applies the
+               fields whose options changed whenever trac.ini changes.
+               Before changing anything the rows about to be changed are
+               saved to a snapshot, whose id is part of the output.""",
                None, self.set_fields_from_config)
+        yield ('restore fields snapshot', '<id>',
+               """restore the ticket field rows saved by an apply
+
+               Puts back the enum and component rows saved before the
+               apply which printed the snapshot id, in one transaction.
+               Tickets moved by renames are not moved back.""",
+               self._complete_snapshot_ids, self.restore_fields_snapshot)
+        yield ('list fields snapshots', '',
+               'list the ids of the saved ticket field snapshots',
+               None, self.list_fields_snapshots)
 
-    def set_fields_from_config(self):
+    def set_fields_from_config(self, *args):
         """
         Update the ticket field option values stored in the trac database with
         the values defined in the config (.ini) file.
         """
-        changes = {}
+        options = self._parse_options(args, ('--force', '--plan', '--watch',
+                                             '--profile', '--refuse-if-used'))
+        profile = '--profile' in options
+        refuse_if_used = '--refuse-if-used' in options
+
+        if '--watch' in options:
+            return self.watch_fields_from_config(
+                profile=profile, refuse_if_used=refuse_if_used)
+        if '--plan' in options:
+            result = self.plan_fields_from_config(
+                profile=profile, refuse_if_used=refuse_if_used)
+        else:
+            result = self.apply_fields_from_config(
+                force='--force' in options, profile=profile,
+                refuse_if_used=refuse_if_used)
+
+        if result['changed']:
+            printout(json.dumps(result))
+
+    def _parse_options(self, args, allowed):
+        """
+        Return the set of command line switches given to a command, raising
+        AdminCommandError for anything not in allowed.
+        """
+        for arg in args:
+            if arg not in allowed:
+                raise AdminCommandError('Unknown option %s' % arg,
+                                        show_usage=True)
+        return set(args)
+
+    def apply_fields_from_config(self, force=False, profile=False,
+                                 refuse_if_used=False, fields=None):
+        """
+        Gather the adds, removes and reorders for every configured field and
+        write them with batched statements inside a single transaction.
+
+        Unless force is set, nothing beyond the fingerprint check is queried
+        when the config and the ticket field tables are unchanged since the
+        last apply.
+
+        With profile set, or the profile option of the config section
+        enabled, the wall time and statement count of every field and phase
+        are added to the result under 'profile'.
+
+        With refuse_if_used set a TracError is raised, and nothing written,
+        when a value to remove is still used by tickets.
+
+        fields restricts the apply to the given field names.  Such partial
+        applies neither check nor store the fingerprint.
+
+        Runs hold the environment lock from before the fingerprint check to
+        the commit, so a run which had to wait for another one finds the
+        fingerprint it stored and returns straight away.
+
+        Returns a dictionary with the changes made and the number of SQL
+        statements issued.
+        """
+        with env_lock(self.env):
+            return self._apply_fields_from_config(force, profile,
+                                                  refuse_if_used, fields)
+
+    def _apply_fields_from_config(self, force, profile, refuse_if_used,
+                                  fields):
+        """
+        The body of apply_fields_from_config, run with the lock held.
+        """
+        profile = {} if self._profiling(profile) else None
+        config = self._get_config_digest()
+        partial = fields is not None
+
+        if not (force or partial):
+            with self.env.db_query as db:
+                db = StatementCounter(db, profile)
+                with db.phase('all', 'fingerprint'):
+                    stored = read_fingerprint(db)
+                    stamp = table_stamp(db)
+            if stored == fingerprint(config, stamp):
+                return self._describe_changes({}, db.count, profile)
+            statements = db.count
+        else:
+            statements = 0
 
-        field_values = self._get_field_values()
+        component_owners = {}
+        field_values = self._get_field_values(component_owners)
+        field_renames = self._get_field_renames(field_values)
+        custom_values = self._get_custom_field_values()
+        custom_renames = self._get_field_renames(custom_values, custom_values)
+        if partial:
+            field_values = dict((field_name, values) for field_name, values
+                                in field_values.items() if field_name in fields)
+            custom_values = dict((field_name, values) for field_name, values
+                                 in custom_values.items()
+                                 if field_name in fields)
+
+        with self.env.db_transaction as db:
+            db = StatementCounter(db, profile)
+            plan = self._plan_changes(
+                db, field_values, field_renames,
+                self._get_field_attributes(field_values, component_owners))
+            custom_plan = self._plan_custom_changes(custom_values,
+                                                    custom_renames)
+            if refuse_if_used:
+                self._check_removed_values_unused(
+                    db, dict(plan, **custom_plan))
+            snapshot = self._take_snapshot(db, plan)
+            self._apply_changes(db, plan)
+            custom_options = self._apply_custom_changes(db, custom_plan)
+            if not partial:
+                # digest the options about to be saved, so the next run is
+                # skipped once they are
+                config = self._get_config_digest(custom_options)
+                with db.phase('all', 'fingerprint'):
+                    write_fingerprint(db,
+                                      fingerprint(config, table_stamp(db)))
+
+        # written once committed, a failed apply leaves no snapshot behind
+        # to rotate a real one out
+        snapshot_id = self._write_snapshot(snapshot)
+        if custom_options:
+            self._save_custom_options(custom_options)
+        if plan.get('milestone'):
+            self._move_milestone_attachments(plan['milestone'])
+        if any(plan.values()) or custom_options:
+            self._fields_changed(milestones=bool(plan.get('milestone')))
+        plan.update(custom_plan)
+
+        result = self._describe_changes(plan, statements + db.count, profile)
+        if snapshot_id is not None:
+            result['snapshot'] = snapshot_id
+        return result
+
+    def _fields_changed(self, milestones=False):
+        """
+        Tell Trac, and the lists cached by the jsontracadmin plugin, that
+        the ticket field tables were written.  Called once per committed
+        change set, never per value, as each reset makes every web worker
+        rebuild its ticket fields.  Trac caches the milestones on their
+        own, that cache is reset too when milestones were written.
+        """
+        from trac.ticket.api import TicketSystem
+        TicketSystem(self.env).reset_ticket_fields()
+        if milestones:
+            from trac.ticket.model import MilestoneCache
+            del MilestoneCache(self.env).milestones
+        bump_stamp(self.env)
+
+    def _move_milestone_attachments(self, field_changes):
+        """
+        Move the attachments of renamed milestones over to their new name
+        and delete those of removed milestones, as Trac does when a
+        milestone is renamed or deleted.  Run after the commit, as
+        attachments are files, and only for milestones having any.
+        """
+        from trac.attachment import Attachment
+        attached = set(name for name, in self.env.db_query("""
+            SELECT DISTINCT id FROM attachment WHERE type='milestone'
+            """))
+        if not attached:
+            return
+
+        merged = set(field_changes.merged)
+        for old, new in field_changes.renamed:
+            if old in attached and (old, new) not in merged:
+                Attachment.reparent_all(self.env, 'milestone', old,
+                                        'milestone', new)
+        for name in field_changes.removed:
+            if name in attached:
+                Attachment.delete_all(self.env, 'milestone', name)
+
+    def _take_snapshot(self, db, plan):
+        """
+        Read the rows of the fields the plan changes, returns the snapshot,
+        or None when nothing changes or snapshot_keep is 0.
+        """
+        changed = [field_name for field_name, field_changes in plan.items()
+                   if field_changes]
+        keep = snapshot_keep(self.env)
+        if not changed or keep <= 0:
+            return None
+
+        with db.phase('all', 'snapshot'):
+            snapshot = take_snapshot(
+                db, [field_name for field_name in changed
+                     if field_name not in self.TABLE_FIELDS],
+                [field_name for field_name in changed
+                 if field_name in self.TABLE_FIELDS])
+        return snapshot
+
+    def _write_snapshot(self, snapshot):
+        """
+        Save a snapshot taken by _take_snapshot(), returns its id or None
+        when there is none.
+        """
+        if snapshot is None:
+            return None
+        write_snapshot(snapshot_dir(self.env), snapshot,
+                       snapshot_keep(self.env))
+        return snapshot['id']
+
+    def restore_fields_snapshot(self, snapshot_id):
+        """
+        Restore the ticket field rows saved in a snapshot within a single
+        transaction.
+        """
+        snapshot = read_snapshot(snapshot_dir(self.env), snapshot_id)
+        with env_lock(self.env):
+            with self.env.db_transaction as db:
+                restore_snapshot(db, snapshot)
+        self._fields_changed(milestones='milestone' in snapshot)
+
+        fields = sorted(snapshot['enum'])
+        fields.extend(field_name for field_name in self.TABLE_FIELDS
+                      if field_name in snapshot)
+        printout(json.dumps({'restored': snapshot_id, 'fields': fields}))
+
+    def list_fields_snapshots(self):
+        """
+        Print the ids of the saved snapshots, oldest first.
+        """
+        printout(json.dumps(list_snapshots(snapshot_dir(self.env))))
+
+    def _complete_snapshot_ids(self, args):
+        if len(args) == 1:
+            return list_snapshots(snapshot_dir(self.env))
+
+    def watch_fields_from_config(self, profile=False, refuse_if_used=False,
+                                 watcher=None):
+        """
+        Apply the config, then keep waiting for trac.ini to change and
+        re-apply only the fields whose options changed since the last
+        successful apply.  Runs until interrupted.
+        """
+        if watcher is None:
+            watcher = ConfigWatcher(self.config.filename)
+
+        applied = None
+        try:
+            while True:
+                current = self._get_field_options()
+                if applied is None:
+                    fields = None
+                else:
+                    fields = [field_name for field_name in current
+                              if current[field_name] != applied.get(field_name)]
+
+                if fields is None or fields:
+                    try:
+                        result = self.apply_fields_from_config(
+                            profile=profile, refuse_if_used=refuse_if_used,
+                            fields=fields)
+                    except TracError as e:
+                        # keep watching, the fields are retried next change
+                        printerr(json.dumps({'changed': False,
+                                             'error': str(e)}))
+                    else:
+                        applied = current
+                        if result['changed']:
+                            printout(json.dumps(result))
+
+                watcher.wait()
+                self.config.parse_if_needed(force=True)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            watcher.close()
+
+    def _get_field_options(self):
+        """
+        Get a lookup of everything the config declares for each field, the
+        values, the renames and for components the owner, used to find the
+        fields that changed between two versions of the config file.
+        """
+        component_owners = {}
+        field_values = self._get_field_values(component_owners)
+        field_renames = self._get_field_renames(field_values)
+
+        field_options = {}
         for field_name, values in field_values.items():
-            field_changes = self._set_field_values_from_config(field_name,
-                                                               values)
-            if field_changes is not None:
-                changes[field_name] = field_changes
+            field_options[field_name] = [values,
+                                         field_renames.get(field_name, [])]
+        field_attributes = self._get_field_attributes(field_values,
+                                                      component_owners)
+        for field_name, attributes in field_attributes.items():
+            field_options[field_name].append(attributes)
+
+        custom_values = self._get_custom_field_values()
+        custom_renames = self._get_field_renames(custom_values, custom_values)
+        for field_name, values in custom_values.items():
+            field_options[field_name] = [values,
+                                         custom_renames.get(field_name, [])]
+        return field_options
+
+    def plan_fields_from_config(self, profile=False, refuse_if_used=False):
+        """
+        Compute the changes apply_fields_from_config would make using only
+        read-only queries, one per table.
+
+        Returns the same dictionary as apply_fields_from_config.
+        """
+        profile = {} if self._profiling(profile) else None
+        component_owners = {}
+        field_values = self._get_field_values(component_owners)
+        field_renames = self._get_field_renames(field_values)
+        custom_values = self._get_custom_field_values()
+        custom_renames = self._get_field_renames(custom_values, custom_values)
+
+        with self.env.db_query as db:
+            db = StatementCounter(db, profile)
+            plan = self._plan_changes(
+                db, field_values, field_renames,
+                self._get_field_attributes(field_values, component_owners))
+            plan.update(self._plan_custom_changes(custom_values,
+                                                  custom_renames))
+            if refuse_if_used:
+                self._check_removed_values_unused(db, plan)
+
+        return self._describe_changes(plan, db.count, profile)
+
+    def get_field_drift(self):
+        """
+        Compare a digest of the values of every configured field, in order,
+        as declared in the config and as stored in the database.  Components
+        are compared by name and owner, milestones and versions by name and
+        the dates the config declares.  Custom fields are compared with
+        their options in [ticket-custom].
+
+        Returns a dictionary of {field name: True when they differ}.
+        """
+        component_owners = {}
+        field_values = self._get_field_values(component_owners)
+        field_attributes = self._get_field_attributes(field_values,
+                                                      component_owners)
+        with self.env.db_query as db:
+            db_rows = self._get_current_field_values(db, field_values.keys())
+
+        drift = {}
+        for field_name, config_field_values in field_values.items():
+            if field_name in self.TABLE_FIELDS:
+                attributes = field_attributes[field_name]
+                config_rows = sorted((name, attributes.get(name))
+                                     for name in config_field_values)
+                rows = sorted((name, declared_attributes(attributes[name],
+                                                         stored)
+                               if attributes.get(name) is not None else None)
+                              for name, stored in db_rows[field_name])
+            else:
+                config_rows = config_field_values
+                rows = [name for name, value in db_rows[field_name]]
+            drift[field_name] = field_digest(config_rows) != field_digest(rows)
+
+        for field_name, config_field_values in \
+                self._get_custom_field_values().items():
+            optional, values = self._get_custom_options(
+                                        field_name[len(CUSTOM_PREFIX):])
+            drift[field_name] = (field_digest(config_field_values) !=
+                                 field_digest(values))
+        return drift
+
+    def _profiling(self, profile):
+        """
+        Profiling is enabled by the caller or by 'profile = true' in the
+        config section.
+        """
+        return profile or self.config.getbool(self.SECTION_NAME, 'profile')
+
+    def _describe_changes(self, plan, statements, profile=None):
+        """
+        Build the JSON friendly result of an apply or a plan.
+        """
+        changes = {}
+        for field_name, field_changes in plan.items():
+            comment = field_changes.comment()
+            if comment is not None:
+                changes[field_name] = comment
+
+        result = {'changed': changes != {}, 'comment': changes,
+                  'statements': statements}
+        if profile is not None:
+            result['profile'] = profile
+        return result
+
+    def _get_config_digest(self, custom_options=None):
+        """
+        Return a digest of the config section as written.  Value files are
+        represented by the digest of their content, so they are not parsed
+        when the fingerprint shows nothing changed.
+
+        The '<field>.options' of configured custom fields are part of the
+        digest, custom_options overrides them with values not saved yet.
+        """
+        config_section = self.config[self.SECTION_NAME]
+        options = dict(config_section.options())
+        files = dict((field_name, file_digest(path)) for field_name, path
+                     in self._get_field_files().items())
 
-        if changes != {}:
-            printout(json.dumps({'changed': True, 'comment': changes}))
+        custom = {}
+        for option in config_section:
+            if (option.startswith(CUSTOM_PREFIX) and
+                    not option.endswith(self.RENAME_SUFFIX)):
+                name = option[len(CUSTOM_PREFIX):]
+                custom[name] = self.config.get(self.CUSTOM_SECTION,
+                                               name + '.options')
+        custom.update(custom_options or {})
+        if custom:
+            return config_digest(options, files, custom)
+        return config_digest(options, files)
 
-    def _get_field_values(self):
+    def _get_field_files(self):
+        """
+        Get a lookup of the value file path for each field with a
+        '<field>_file' option, relative paths start at the config file.
+        """
+        field_files = {}
+        for field_name in self.FIELD_PANELS:
+            option = field_name + self.FILE_SUFFIX
+            if self.config.get(self.SECTION_NAME, option):
+                field_files[field_name] = self.config.getpath(
+                                                self.SECTION_NAME, option)
+        return field_files
+
+    def _get_field_values(self, component_owners=None):
         """
         Get a lookup of the field values for each option in the relavent section
-        of the config file.
+        of the config file, or in the file named by its '<field>_file' option.
+
+        The owners given to components in a file are added to
+        component_owners when a dictionary is passed.
         """
         field_values = {}
 
@@ -87,12 +576,194 @@ class TicketFieldConfigCommand(Component):
         config_section = self.config[self.SECTION_NAME]
 
         for config_option in config_section:
-            if config_option in self.panels:
+            if config_option in self.FIELD_PANELS:
                 field_values[config_option] = config_section.getlist(
                                                                 config_option)
 
+        for field_name, path in self._get_field_files().items():
+            if field_name in field_values:
+                msg = 'Both %s and %s%s are set in config' % (
+                                    field_name, field_name, self.FILE_SUFFIX)
+                raise TracError(msg)
+            field_values[field_name] = self._read_field_file(
+                                        field_name, path, component_owners)
+
+        for field_name, values in field_values.items():
+            self._check_duplicate_values(field_name, values)
+
         return field_values
 
+    def _read_field_file(self, field_name, path, component_owners=None):
+        """
+        Return the values listed in a value file.  Components listed
+        without an owner need component_owner in the config.
+        """
+        values = []
+        for name, owner in read_field_file(path):
+            values.append(name)
+            if field_name != self.COMPONENT_FIELD_NAME:
+                continue
+            if owner:
+                if component_owners is not None:
+                    component_owners[name] = owner
+            elif not self._get_component_owner():
+                msg = 'Component %s in %s has no owner and component_owner ' \
+                      'is missing in config' % (name, path)
+                raise TracError(msg)
+        return values
+
+    def _get_custom_field_values(self):
+        """
+        Get a lookup of the options declared for [ticket-custom] fields
+        with options like 'custom.os = linux,macos,windows', keyed by
+        option name.  Only select and radio fields have options.
+        """
+        field_values = {}
+        config_section = self.config[self.SECTION_NAME]
+
+        for config_option in config_section:
+            if (not config_option.startswith(CUSTOM_PREFIX) or
+                    config_option.endswith(self.RENAME_SUFFIX)):
+                continue
+            name = config_option[len(CUSTOM_PREFIX):]
+            if self.config.get(self.CUSTOM_SECTION, name) \
+                    not in self.CUSTOM_TYPES:
+                msg = 'Custom field %s is not a select or radio field in ' \
+                      '[%s]' % (name, self.CUSTOM_SECTION)
+                raise TracError(msg)
+            values = config_section.getlist(config_option)
+            for value in values:
+                if '|' in value:
+                    msg = 'Invalid value %s for %s, options cannot ' \
+                          'contain |' % (value, config_option)
+                    raise TracError(msg)
+            self._check_duplicate_values(config_option, values)
+            field_values[config_option] = values
+
+        return field_values
+
+    def _get_custom_options(self, name):
+        """
+        Return (optional, options) for a custom field, optional is True
+        when '<field>.options' starts with an empty option, which makes
+        the field optional and is kept whatever the config declares.  An
+        unset or empty '<field>.options' has no options and is not
+        optional.
+        """
+        value = self.config.get(self.CUSTOM_SECTION, name + '.options')
+        if not value.strip():
+            return False, []
+        options = [option.strip() for option in value.split('|')]
+        return options[0] == '', [option for option in options if option]
+
+    def _plan_custom_changes(self, custom_values, custom_renames):
+        """
+        Compute the changes needed for the options of every configured
+        custom field, read from [ticket-custom] so without any query.
+
+        Returns a dictionary of FieldChanges keyed by option name.
+        """
+        plan = {}
+        for field_name, config_field_values in custom_values.items():
+            optional, options = self._get_custom_options(
+                                            field_name[len(CUSTOM_PREFIX):])
+            plan[field_name] = FieldChanges(
+                field_name, [(name, index + 1) for index, name
+                             in enumerate(options)],
+                config_field_values, renames=custom_renames.get(field_name, ()))
+        return plan
+
+    def _apply_custom_changes(self, db, custom_plan):
+        """
+        Move the tickets using renamed custom field options over with one
+        UPDATE of ticket_custom per mapping.  Tickets using options which
+        are only removed keep their value.
+
+        Returns the '<field>.options' value to save for every custom field
+        that changed, by field name.  Nothing is saved here, so that a
+        failing transaction leaves trac.ini untouched.
+        """
+        history = self._get_rename_history()
+        custom_options = {}
+        for field_name, field_changes in custom_plan.items():
+            if not field_changes:
+                continue
+            with db.phase(field_name, 'rename'):
+                for old, new in field_changes.renamed:
+                    remap_tickets(db, field_name, old, new, history)
+            name = field_name[len(CUSTOM_PREFIX):]
+            optional, options = self._get_custom_options(name)
+            custom_options[name] = '|'.join(([''] if optional else []) +
+                                            field_changes.config_values)
+        return custom_options
+
+    def _save_custom_options(self, custom_options):
+        """
+        Write the options of every changed custom field to trac.ini with a
+        single save, so running Trac processes reload the file once.
+        """
+        for name, options in sorted(custom_options.items()):
+            self.config.set(self.CUSTOM_SECTION, name + '.options', options)
+        self.config.save()
+
+    def _get_field_renames(self, field_values, field_names=None):
+        """
+        Get a lookup of the (old, new) renames declared for each field with
+        options like 'priority_rename = major:P2,minor:P3'.  field_names
+        defaults to the built-in fields.
+        """
+        field_renames = {}
+        config_section = self.config[self.SECTION_NAME]
+
+        if field_names is None:
+            field_names = self.FIELD_PANELS
+        for field_name in field_names:
+            option = field_name + self.RENAME_SUFFIX
+            for mapping in config_section.getlist(option):
+                old, sep, new = mapping.partition(':')
+                old, new = old.strip(), new.strip()
+                if not (sep and old and new):
+                    msg = 'Invalid rename %s in %s, expected old:new' % (
+                                                            mapping, option)
+                    raise TracError(msg)
+                if old in field_values.get(field_name, ()):
+                    msg = 'Renamed value %s is still listed in %s' % (
+                                                            old, field_name)
+                    raise TracError(msg)
+                # the renamed row would be removed again, leaving its
+                # tickets on a value which no longer exists
+                if (field_name in field_values and
+                        new not in field_values[field_name]):
+                    msg = 'New value %s of rename %s is not listed in %s' % (
+                                                new, mapping, field_name)
+                    raise TracError(msg)
+                field_renames.setdefault(field_name, []).append((old, new))
+
+        # every mapping moves tickets with the same history time, a chain
+        # would write two ticket_change rows for one ticket and field
+        for field_name, renames in field_renames.items():
+            targets = set(new for old, new in renames)
+            for old, new in renames:
+                if old in targets:
+                    msg = 'Renamed value %s is the new name of another ' \
+                          'rename in %s%s, rename to the final name ' \
+                          'instead' % (old, field_name, self.RENAME_SUFFIX)
+                    raise TracError(msg)
+
+        return field_renames
+
+    def _get_rename_history(self):
+        """
+        Return the (author, time) used for the ticket_change rows written
+        when tickets are remapped by a rename, or None when
+        'rename_history' is not enabled in the config section.
+        """
+        if not self.config.getbool(self.SECTION_NAME, 'rename_history'):
+            return None
+        from trac.util.datefmt import to_utimestamp, utc
+        from datetime import datetime
+        return ('trac-admin', to_utimestamp(datetime.now(utc)))
+
     def _check_section_present(self):
         """
         Check that the section for this plugin is present.
@@ -115,94 +786,281 @@ class TicketFieldConfigCommand(Component):
                    is missing in config"
             raise TracError(msg)
 
-    def _set_field_values_from_config(self, field_name, config_field_values):
+    def _check_duplicate_values(self, field_name, values):
+        """
+        Check that a field does not list the same value twice, the bulk
+        inserts would otherwise fail part way on the unique name.
+        """
+        seen = set()
+        duplicates = []
+        for value in values:
+            if value in seen and value not in duplicates:
+                duplicates.append(value)
+            seen.add(value)
+
+        if duplicates:
+            msg = 'Duplicate values for %s in config: %s' % (
+                                            field_name, ', '.join(duplicates))
+            raise TracError(msg)
+
+    def _plan_changes(self, db, field_values, field_renames,
+                      field_attributes=None):
         """
-        Set the field values for given field name in the trac database based
-        on what is defined in the config file adding and removing field values
-        as neccessary.
+        Compute the changes needed for every configured field, including
+        the renames declared for it, without writing anything.
+        field_attributes holds the owners of components and the dates of
+        milestones and versions, see _get_field_attributes().
 
-        Returns a dictionary of the changes made during this process.
+        Returns a dictionary of FieldChanges keyed by field name.
         """
-        field_changes = None
+        field_attributes = field_attributes or {}
+        with db.phase('all', 'read'):
+            db_rows = self._get_current_field_values(db, field_values.keys())
 
-        db_field_values = self._get_current_field_values(field_name)
+        plan = {}
+        for field_name, config_field_values in field_values.items():
+            plan[field_name] = self._set_field_values_from_config(
+                field_name, db_rows[field_name], config_field_values,
+                field_renames.get(field_name, ()),
+                field_attributes.get(field_name))
+        return plan
 
-        values_to_remove = set(db_field_values) - set(config_field_values)
-        values_to_add = set(config_field_values) - set(db_field_values)
+    def _get_field_attributes(self, field_values, component_owners=None):
+        """
+        Get a lookup of the attributes declared for the values of the
+        fields stored in tables of their own: the owner of every component
+        and the dates of the milestones and versions which have any.
+        """
+        field_attributes = {}
+        if self.COMPONENT_FIELD_NAME in field_values:
+            field_attributes[self.COMPONENT_FIELD_NAME] = \
+                self._get_component_owners(
+                    field_values[self.COMPONENT_FIELD_NAME], component_owners)
+        for field_name in DATE_COLUMNS:
+            if field_name in field_values:
+                field_attributes[field_name] = self._get_field_dates(
+                    field_name, field_values[field_name])
+        return field_attributes
 
-        self._remove_values_from_database(field_name, values_to_remove)
-        self._add_values_to_database(field_name, values_to_add)
+    def _get_field_dates(self, field_name, values):
+        """
+        Get a lookup of the dates declared for milestones or versions with
+        options like 'milestone_due = 2026Q1:2026-03-31', as
+        {name: {date column: date}}.
+        """
+        dates = {}
+        config_section = self.config[self.SECTION_NAME]
 
-        diff_order = self._reorder_field_values(field_name, config_field_values)
+        for column in DATE_COLUMNS[field_name]:
+            option = '%s_%s' % (field_name, column)
+            for mapping in config_section.getlist(option):
+                name, sep, date = mapping.rpartition(':')
+                name, date = name.strip(), date.strip()
+                try:
+                    date_to_timestamp(date)
+                except ValueError:
+                    sep = None
+                if not (sep and name):
+                    msg = 'Invalid date %s in %s, expected name:YYYY-MM-DD' \
+                          % (mapping, option)
+                    raise TracError(msg)
+                if name not in values:
+                    msg = 'Date for %s in %s which is not listed in %s' % (
+                                                    name, option, field_name)
+                    raise TracError(msg)
+                dates.setdefault(name, {})[column] = date
 
-        if len(values_to_add) > 0 or len(values_to_remove) > 0 or diff_order is not None:
-            field_changes = {
-                'Added'   : list(values_to_add),
-                'Removed' : list(values_to_remove),
-                'Reordered' : diff_order
-            }
+        return dates
 
-        return field_changes
+    def _get_component_owners(self, names, component_owners=None):
+        """
+        Get a lookup of the owner every listed component should have.
+        """
+        component_owners = component_owners or {}
+        owner = self._get_component_owner()
+        return dict((name, component_owners.get(name, owner))
+                    for name in names)
 
-    def _get_current_field_values(self, field_name):
+    def _check_removed_values_unused(self, db, plan):
         """
-        The the current values for a given ticket field that exist in the
-        Trac environment database.  For enum that are not components, this
-        will be an ordered list by enum.value position.
+        Check that no ticket uses a value about to be removed, counting
+        the tickets with one aggregated query per field with removals.
+        Values merged by a rename are skipped, their tickets are moved.
+        If any is used raise TracError exception.
         """
-        if field_name == self.COMPONENT_FIELD_NAME:
-            field_values = self.panels[field_name].get_component_list()
-        else:
-            # get_enum_list() returns a list of enums ORDER BY value.
-            field_values = self.panels[field_name].get_enum_list()
+        removing = dict((field_name, set(field_changes.removed) -
+                         set(old for old, new in field_changes.merged))
+                        for field_name, field_changes in plan.items())
+        removing = dict((field_name, values)
+                        for field_name, values in removing.items() if values)
 
-        return field_values
+        with db.phase('all', 'usage'):
+            usage = select_ticket_usage(db, removing.keys())
 
-    def _remove_values_from_database(self, field_name, field_values):
+        used = []
+        for field_name in sorted(removing):
+            for value in sorted(removing[field_name]):
+                if usage[field_name].get(value):
+                    used.append('%s %s (%d tickets)' % (
+                        field_name, value, usage[field_name][value]))
+
+        if used:
+            msg = 'Refusing to remove values used by tickets: %s' % \
+                  ', '.join(used)
+            raise TracError(msg)
+
+    def _apply_changes(self, db, plan):
         """
-        Remove a list of field values from the trac environement database.
+        Write the planned changes of every field using the given connection.
         """
-        for value in field_values:
-            self.panels[field_name]._do_remove(value)
+        history = self._get_rename_history()
+        for field_name, field_changes in plan.items():
+            with db.phase(field_name, 'rename'):
+                self._rename_values_in_database(db, field_changes, history)
+            with db.phase(field_name, 'remove'):
+                self._remove_values_from_database(db, field_changes)
+            with db.phase(field_name, 'add'):
+                self._add_values_to_database(db, field_changes)
+            with db.phase(field_name, 'update'):
+                self._update_attributes_in_database(db, field_changes)
+            with db.phase(field_name, 'reorder'):
+                self._reorder_values_in_db(db, field_changes)
 
-    def _add_values_to_database(self, field_name, field_values):
+    def _get_component_owner(self):
         """
-        Add a list of field values to the trac environement database.
+        Return the owner given to components created from the config file.
         """
-        for value in field_values:
-            if field_name == self.COMPONENT_FIELD_NAME:
-                self.panels[field_name]._do_add(value,
-                    self.config[field_name].get(self.COMPONENT_OWNER_FIELD))
-            else:
-                self.panels[field_name]._do_add(value)
+        return self.config[self.SECTION_NAME].get(self.COMPONENT_OWNER_FIELD)
 
-    def get_enums_from_panel(self, panel_name):
+    def _set_field_values_from_config(self, field_name, db_rows,
+                                      config_field_values, renames=(),
+                                      attributes=None):
         """
-        Return a list of all enum objects for a given panel_name
+        Compare the field values for given field name in the trac database
+        with what is defined in the config file.
+
+        Returns the FieldChanges needed to bring the database in line.
         """
-        return self.panels[panel_name]._enum_cls.select(self.env)
+        return FieldChanges(field_name, db_rows, config_field_values,
+                            ordered=field_name not in self.TABLE_FIELDS,
+                            renames=renames, attributes=attributes,
+                            attribute_label='Owner'
+                            if field_name == self.COMPONENT_FIELD_NAME
+                            else 'Dates')
 
-    def _reorder_values_in_db(self, panel_name, desired_order):
+    def _get_current_field_values(self, db, field_names):
         """
-        Order the field values by the order in the configuration file
+        The the current values for the given ticket fields that exist in the
+        Trac environment database, read with at most one query per table.
+        For enum that are not components, this will be a list of
+        (name, value) ordered by enum.value position, components are
+        (name, owner) pairs, milestones and versions (name, {column: date}).
         """
-        enums = self.get_enums_from_panel(panel_name)
+        field_names = set(field_names)
+        field_values = {}
 
-        for enum in enums:
-            proper_position = desired_order.index(enum.name) + 1
-            if enum.value != proper_position:
-                enum.value = proper_position
-                enum.update()
+        if self.COMPONENT_FIELD_NAME in field_names:
+            field_names.discard(self.COMPONENT_FIELD_NAME)
+            field_values[self.COMPONENT_FIELD_NAME] = \
+                select_component_rows(db)
+        for field_name in DATE_COLUMNS:
+            if field_name in field_names:
+                field_names.discard(field_name)
+                field_values[field_name] = select_dated_rows(db, field_name)
+        if field_names:
+            field_values.update(select_enum_rows(db, field_names))
 
-    def _reorder_field_values(self, panel_name, desired_field_order):
-        diff_order = None
-        if panel_name != self.COMPONENT_FIELD_NAME:
-            db_field_order = self._get_current_field_values(panel_name)
+        return field_values
 
-            if desired_field_order != db_field_order:
-                # we need to reorder enums
-                diff_order = "{} -> {}".format(db_field_order, desired_field_order)
-                self._reorder_values_in_db(panel_name, desired_field_order)
-        return diff_order
-        
+    def _rename_values_in_database(self, db, field_changes, history=None):
+        """
+        Rename field values in place and move the tickets using the old
+        names over with one UPDATE per mapping.  Merged values keep their
+        old row, which is then removed with the other removals.
+        """
+        for old, new in field_changes.renamed:
+            self.log.info("Renaming %s %s to %s", field_changes.field_name,
+                          old, new)
+            if (old, new) not in field_changes.merged:
+                if field_changes.field_name in self.TABLE_FIELDS:
+                    rename_named(db, field_changes.field_name, old, new)
+                else:
+                    rename_enum(db, field_changes.field_name, old, new)
+            remap_tickets(db, field_changes.field_name, old, new, history)
 
+    def _remove_values_from_database(self, db, field_changes):
+        """
+        Remove the field values missing from the config in one batch.
+        """
+        if field_changes.removed:
+            self.log.info("Deleting %s %s", field_changes.field_name,
+                          ', '.join(field_changes.removed))
+        if field_changes.field_name in self.TABLE_FIELDS:
+            delete_named(db, field_changes.field_name, field_changes.removed)
+        else:
+            delete_enums(db, field_changes.field_name, field_changes.removed)
+
+    def _add_values_to_database(self, db, field_changes):
+        """
+        Add the field values missing from the database in one batch.  Enum
+        values are inserted straight into their configured position.
+        """
+        if field_changes.added:
+            self.log.info("Creating new %s %s", field_changes.field_name,
+                          ', '.join(field_changes.added))
+        if field_changes.field_name == self.COMPONENT_FIELD_NAME:
+            insert_components(db, field_changes.added,
+                              self._get_component_owner(),
+                              field_changes.attributes)
+        elif field_changes.field_name in DATE_COLUMNS:
+            insert_dated(db, field_changes.field_name, field_changes.added,
+                         field_changes.attributes)
+        else:
+            insert_enums(db, field_changes.field_name,
+                         [(name, field_changes.positions[name])
+                          for name in field_changes.added])
+
+    def _update_attributes_in_database(self, db, field_changes):
+        """
+        Give the components whose owner, and the milestones and versions
+        whose dates, drifted from the config their configured ones, with one
+        bulk UPDATE per column.
+        """
+        if not field_changes.attributes_changed:
+            return
+        self.log.info("Updating %s %s", field_changes.field_name,
+                      ', '.join(name for name, old, new
+                                in field_changes.attributes_changed))
+        rows = [(name, new) for name, old, new
+                in field_changes.attributes_changed]
+        if field_changes.field_name == self.COMPONENT_FIELD_NAME:
+            update_column(db, 'component', 'owner', rows)
+        else:
+            update_dates(db, field_changes.field_name, rows)
+
+    def get_enums_from_panel(self, panel_name):
+        """
+        Return a list of all enum objects for a given panel_name
+        """
+        return self.get_panel(panel_name)._enum_cls.select(self.env)
+
+    def get_panel(self, field_name):
+        """
+        Return the admin panel of a field.  Panels are imported and created
+        on first use, so trac-admin commands which are not provided by this
+        plugin do not pay for them.
+        """
+        if field_name not in self.panels:
+            from trac.ticket import admin
+            panel_cls = getattr(admin, self.FIELD_PANELS[field_name])
+            self.panels[field_name] = panel_cls(self.env)
+        return self.panels[field_name]
+
+    def _reorder_values_in_db(self, db, field_changes):
+        """
+        Order the field values by the order in the configuration file.  Only
+        rows whose position changed are rewritten, all in one bulk UPDATE.
+        """
+        if field_changes.repositioned:
+            update_enum_positions(db, field_changes.field_name,
+                                  field_changes.repositioned)
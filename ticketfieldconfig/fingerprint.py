@@ -0,0 +1,71 @@
+"""
+Fingerprint of a converged environment, used to skip runs of
+'set fields from config' when neither the [ticket-field-config] section nor
+the ticket field tables changed since the last successful apply.
+"""
+
+import hashlib
+import json
+
+# name of the row in the Trac system table holding the last fingerprint
+SYSTEM_KEY = 'ticket_field_config_fingerprint'
+
+
+def config_digest(*parts):
+    """
+    Return a stable digest of the [ticket-field-config] section, given as
+    any number of JSON serializable parts.
+    """
+    document = json.dumps(parts, sort_keys=True)
+    return hashlib.sha1(document.encode('utf-8')).hexdigest()
+
+
+def table_stamp(db):
+    """
+    Return a digest of the enum, component, milestone and version tables,
+    read with one query per table.
+    """
+    digest = hashlib.sha1()
+    for query in ("SELECT type, name, value FROM enum "
+                  "ORDER BY type, name",
+                  "SELECT name, owner FROM component ORDER BY name",
+                  "SELECT name, due, completed FROM milestone ORDER BY name",
+                  "SELECT name, time FROM version ORDER BY name"):
+        for row in db(query):
+            digest.update(json.dumps(row).encode('utf-8'))
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+
+def fingerprint(config, stamp):
+    """
+    Combine a config digest and a table stamp into a single fingerprint.
+    """
+    return hashlib.sha1(('%s:%s' % (config, stamp)).encode('utf-8')).hexdigest()
+
+
+def field_digest(rows):
+    """
+    Return a stable digest of the ordered values of one field, rows may be
+    names or (name, owner) pairs.
+    """
+    document = json.dumps([list(row) if isinstance(row, tuple) else row
+                           for row in rows], sort_keys=True)
+    return hashlib.sha1(document.encode('utf-8')).hexdigest()
+
+
+def read_fingerprint(db):
+    """
+    Return the fingerprint stored by the last apply, or None.
+    """
+    for value, in db("SELECT value FROM system WHERE name=%s", (SYSTEM_KEY,)):
+        return value
+    return None
+
+
+def write_fingerprint(db, value):
+    """
+    Store the fingerprint of the environment as it is after an apply.
+    """
+    db("DELETE FROM system WHERE name=%s", (SYSTEM_KEY,))
+    db("INSERT INTO system (name, value) VALUES (%s,%s)", (SYSTEM_KEY, value))
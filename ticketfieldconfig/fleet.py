@@ -0,0 +1,193 @@
+"""
+Converge many Trac environments from one process.
+
+Each worker of a bounded process pool opens environments one after the
+other and runs TicketFieldConfigCommand against them, so Python startup and
+plugin discovery are paid once per worker instead of once per environment.
+One JSON line is written to stdout for every environment as it finishes:
+
+ trac-field-config-fleet --parent /srv/trac --jobs 8
+ trac-field-config-fleet /srv/trac/project1 /srv/trac/project2 --plan
+
+With --drift nothing is applied.  Each worker compares a digest of every
+configured field in the config and in the database of its environments and
+returns only whether they differ, and a single JSON matrix is written:
+
+ {"fields":["component","priority"],
+  "environments":{"/srv/trac/project1":[false,true],
+                  "/srv/trac/project2":[false,null]},
+  "errors":{}}
+
+null marks a field the environment does not configure.
+
+The exit code is 1 when any environment failed.
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+
+from trac.env import open_environment
+
+from ticketfieldconfig import TicketFieldConfigCommand
+
+
+def find_environments(parent):
+    """
+    Return the sorted paths of the Trac environments directly below parent.
+    """
+    paths = []
+    for name in sorted(os.listdir(parent)):
+        path = os.path.join(parent, name)
+        if os.path.isfile(os.path.join(path, 'conf', 'trac.ini')):
+            paths.append(path)
+    return paths
+
+
+def converge(path, force=False, plan=False):
+    """
+    Apply (or plan) the [ticket-field-config] section of one environment.
+
+    Never raises, failures are returned as a result with an 'error' key so
+    a single broken environment does not stop the rest of the fleet.
+    """
+    try:
+        env = open_environment(path)
+        try:
+            command = TicketFieldConfigCommand(env)
+            if plan:
+                result = command.plan_fields_from_config()
+            else:
+                result = command.apply_fields_from_config(force=force)
+        finally:
+            env.shutdown()
+    except Exception as e:
+        return {'env': path, 'error': '%s: %s' % (e.__class__.__name__, e)}
+
+    result['env'] = path
+    return result
+
+
+def _converge(args):
+    return converge(*args)
+
+
+def drift(path):
+    """
+    Return which configured fields of one environment differ from the
+    database, as {'env': path, 'drift': {field name: bool}}.
+
+    Never raises, failures are returned as a result with an 'error' key.
+    """
+    try:
+        env = open_environment(path)
+        try:
+            field_drift = TicketFieldConfigCommand(env).get_field_drift()
+        finally:
+            env.shutdown()
+    except Exception as e:
+        return {'env': path, 'error': '%s: %s' % (e.__class__.__name__, e)}
+
+    return {'env': path, 'drift': field_drift}
+
+
+def _imap(function, tasks, jobs=None):
+    """
+    Yield function(task) for every task as the workers of a pool of at most
+    jobs processes finish them.
+    """
+    pool = multiprocessing.Pool(processes=jobs)
+    try:
+        for result in pool.imap_unordered(function, tasks):
+            yield result
+    finally:
+        pool.close()
+        pool.join()
+
+
+def run(paths, jobs=None, force=False, plan=False, out=None):
+    """
+    Converge every environment in paths using at most jobs processes,
+    writing one JSON line per environment to out as each one finishes.
+
+    Returns the number of environments which failed.
+    """
+    out = out or sys.stdout
+    failures = 0
+
+    tasks = [(path, force, plan) for path in paths]
+    for result in _imap(_converge, tasks, jobs):
+        if 'error' in result:
+            failures += 1
+        out.write(json.dumps(result, sort_keys=True) + '\n')
+        out.flush()
+
+    return failures
+
+
+def drift_report(paths, jobs=None):
+    """
+    Build the drift matrix of every environment in paths using at most
+    jobs processes.  Rows follow the sorted field names, with null for
+    fields an environment does not configure.
+    """
+    environments = {}
+    errors = {}
+    for result in _imap(drift, paths, jobs):
+        if 'error' in result:
+            errors[result['env']] = result['error']
+        else:
+            environments[result['env']] = result['drift']
+
+    fields = sorted(set(field_name for field_drift in environments.values()
+                        for field_name in field_drift))
+    return {
+        'fields': fields,
+        'environments': dict(
+            (path, [field_drift.get(field_name) for field_name in fields])
+            for path, field_drift in environments.items()),
+        'errors': errors,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Apply [ticket-field-config] to many Trac environments.')
+    parser.add_argument('paths', nargs='*', metavar='ENV',
+                        help='path of a Trac environment')
+    parser.add_argument('--parent', action='append', default=[],
+                        help='directory whose subdirectories are Trac '
+                             'environments, may be repeated')
+    parser.add_argument('--jobs', '-j', type=int, default=None,
+                        help='number of worker processes '
+                             '(default: number of CPUs)')
+    parser.add_argument('--force', action='store_true',
+                        help='apply even when the stored fingerprint matches')
+    parser.add_argument('--plan', action='store_true',
+                        help='report the changes without writing them')
+    parser.add_argument('--drift', action='store_true',
+                        help='report which fields differ from the config '
+                             'as one JSON matrix, without writing anything')
+    options = parser.parse_args(argv)
+
+    paths = list(options.paths)
+    for parent in options.parent:
+        paths.extend(find_environments(parent))
+    if not paths:
+        parser.error('no Trac environments given')
+
+    if options.drift:
+        report = drift_report(paths, jobs=options.jobs)
+        sys.stdout.write(json.dumps(report, sort_keys=True,
+                                    separators=(',', ':')) + '\n')
+        return 1 if report['errors'] else 0
+
+    failures = run(paths, jobs=options.jobs, force=options.force,
+                   plan=options.plan)
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,161 @@
+"""
+Environment wide lock serializing the runs of 'set fields from config', so
+that a config management run and a manual one cannot interleave.
+
+SQLite environments lock a file in the environment directory, PostgreSQL
+and MySQL take an advisory lock named after the database.  Waiting is
+bounded, in trac.ini:
+
+ [ticket-field-config]
+ lock_timeout = 60
+ lock_backoff = 0.05
+
+lock_timeout is the number of seconds to wait before giving up and
+lock_backoff the first pause between attempts, doubled after every failed
+attempt up to MAX_BACKOFF seconds.
+"""
+
+from contextlib import contextmanager
+import hashlib
+import os
+import time
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from trac.core import TracError
+
+SECTION_NAME = 'ticket-field-config'
+LOCK_FILE = 'ticket-field-config.lock'
+DEFAULT_TIMEOUT = 60
+DEFAULT_BACKOFF = 0.05
+MAX_BACKOFF = 2.0
+
+
+def _lock_key(env):
+    # the database string includes the schema, so environments sharing a
+    # PostgreSQL database get locks of their own
+    database = env.config.get('trac', 'database')
+    return hashlib.sha1(('ticketfieldconfig:%s' % database)
+                        .encode('utf-8')).hexdigest()
+
+
+class FileLock(object):
+    """
+    Exclusive lock on a file, released by the operating system should the
+    process die.  Without fcntl (Windows) the file itself is the lock.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.fd = None
+
+    def acquire(self):
+        if fcntl is None:
+            try:
+                self.fd = os.open(self.path,
+                                  os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except OSError:
+                return False
+            return True
+
+        fd = os.open(self.path, os.O_CREAT | os.O_WRONLY)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except (IOError, OSError):
+            os.close(fd)
+            return False
+        self.fd = fd
+        return True
+
+    def release(self):
+        os.close(self.fd)
+        self.fd = None
+        if fcntl is None:
+            os.unlink(self.path)
+
+
+class AdvisoryLock(object):
+    """
+    Session level advisory lock of PostgreSQL or MySQL, held on a pooled
+    connection for as long as the lock is.
+    """
+
+    def __init__(self, env, scheme):
+        self.env = env
+        self.scheme = scheme
+        self.key = _lock_key(env)
+        self.db = None
+
+    def _query(self, sql):
+        cursor = self.db.cursor()
+        if self.scheme == 'postgres':
+            # pg advisory locks take a bigint
+            cursor.execute(sql, (int(self.key[:15], 16),))
+        else:
+            # MySQL lock names are limited to 64 characters
+            cursor.execute(sql, ('ticketfieldconfig-' + self.key[:32],))
+        return cursor.fetchone()[0]
+
+    def acquire(self):
+        from trac.db.api import DatabaseManager
+        self.db = DatabaseManager(self.env).get_connection()
+        if self.scheme == 'postgres':
+            locked = self._query("SELECT pg_try_advisory_lock(%s)")
+        else:
+            locked = self._query("SELECT GET_LOCK(%s, 0)")
+        if not locked:
+            self.db.close()
+            self.db = None
+        return bool(locked)
+
+    def release(self):
+        try:
+            if self.scheme == 'postgres':
+                self._query("SELECT pg_advisory_unlock(%s)")
+            else:
+                self._query("SELECT RELEASE_LOCK(%s)")
+        finally:
+            self.db.close()
+            self.db = None
+
+
+def make_lock(env):
+    """
+    Return the lock suited to the database of an environment.
+    """
+    scheme = env.config.get('trac', 'database').split(':', 1)[0]
+    if scheme in ('postgres', 'mysql'):
+        return AdvisoryLock(env, scheme)
+    return FileLock(os.path.join(env.path, LOCK_FILE))
+
+
+@contextmanager
+def env_lock(env, timeout=None, backoff=None):
+    """
+    Hold the lock of an environment, waiting at most timeout seconds for
+    it with exponential backoff.  Raises TracError on timeout.
+    """
+    if timeout is None:
+        timeout = env.config.getfloat(SECTION_NAME, 'lock_timeout',
+                                      DEFAULT_TIMEOUT)
+    if backoff is None:
+        backoff = env.config.getfloat(SECTION_NAME, 'lock_backoff',
+                                      DEFAULT_BACKOFF)
+
+    lock = make_lock(env)
+    deadline = time.time() + timeout
+    while not lock.acquire():
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            raise TracError('Timed out after %s seconds waiting for another '
+                            'set fields from config run' % timeout)
+        time.sleep(min(backoff, remaining))
+        backoff = min(backoff * 2, MAX_BACKOFF)
+
+    try:
+        yield
+    finally:
+        lock.release()
@@ -0,0 +1,159 @@
+"""
+Snapshots of the ticket field rows touched by 'set fields from config'.
+
+Before writing anything an apply reads the enum rows of every field it is
+about to change, and the whole component, milestone or version table when
+those change.  Once the apply committed they are saved to a small JSON file
+in the environment:
+
+ <env>/snapshots/ticket-field-config/<id>.json
+
+'trac-admin /path/to/env restore fields snapshot <id>' puts those rows back
+in one transaction.  Only the field tables are read and written, so both
+take the same time however many tickets there are.
+
+The directory and the number of snapshots kept are set in trac.ini:
+
+ [ticket-field-config]
+ snapshot_dir = snapshots/ticket-field-config
+ snapshot_keep = 20
+"""
+
+import json
+import os
+import re
+import tempfile
+import time
+import uuid
+
+from trac.core import TracError
+
+# columns saved for the enum rows of each type
+ENUM_COLUMNS = ('name', 'value', 'description')
+
+# columns saved for the fields stored in a table of their own
+TABLE_COLUMNS = {
+    'component': ('name', 'owner', 'description'),
+    'milestone': ('name', 'due', 'completed', 'description'),
+    'version': ('name', 'time', 'description'),
+}
+
+SECTION_NAME = 'ticket-field-config'
+DEFAULT_SNAPSHOT_DIR = os.path.join('snapshots', 'ticket-field-config')
+DEFAULT_KEEP = 20
+
+SNAPSHOT_ID = re.compile(r'^[0-9]{8}T[0-9]{6}-[0-9a-f]{6}$')
+
+
+def snapshot_dir(env):
+    """
+    Return the snapshot directory of an environment, snapshot_dir in the
+    [ticket-field-config] section, relative to the environment directory.
+    """
+    path = env.config.get(SECTION_NAME, 'snapshot_dir') or DEFAULT_SNAPSHOT_DIR
+    return os.path.join(env.path, path)
+
+
+def snapshot_keep(env):
+    """
+    Return how many snapshots to keep, 0 disables snapshots.
+    """
+    return env.config.getint(SECTION_NAME, 'snapshot_keep', DEFAULT_KEEP)
+
+
+def take_snapshot(db, enum_types, tables=()):
+    """
+    Read the rows of the given enum types, and of the given tables of
+    TABLE_COLUMNS, with one query per table.
+    """
+    snapshot = {
+        'id': '%s-%s' % (time.strftime('%Y%m%dT%H%M%S', time.gmtime()),
+                         uuid.uuid4().hex[:6]),
+        'time': time.time(),
+        'enum': dict((enum_type, []) for enum_type in enum_types),
+    }
+
+    if enum_types:
+        for row in db("""
+                SELECT type, %s FROM enum WHERE type IN (%s)
+                """ % (', '.join(ENUM_COLUMNS),
+                       ','.join(['%s'] * len(enum_types))), list(enum_types)):
+            snapshot['enum'][row[0]].append(list(row[1:]))
+    for table in tables:
+        snapshot[table] = [list(row) for row in db(
+            "SELECT %s FROM %s" % (', '.join(TABLE_COLUMNS[table]), table))]
+
+    return snapshot
+
+
+def write_snapshot(directory, snapshot, keep=DEFAULT_KEEP):
+    """
+    Write a snapshot to directory, then remove the oldest snapshots above
+    keep.
+    """
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+
+    # write to a temporary file first so a restore never sees partial data
+    fd, tmp = tempfile.mkstemp(dir=directory)
+    try:
+        os.write(fd, json.dumps(snapshot, sort_keys=True).encode('utf-8'))
+    finally:
+        os.close(fd)
+    os.rename(tmp, os.path.join(directory, snapshot['id'] + '.json'))
+
+    # the ids start with the time they were taken, so they sort by age
+    names = sorted(name for name in os.listdir(directory)
+                   if SNAPSHOT_ID.match(name[:-len('.json')]))
+    for name in names[:max(0, len(names) - keep)]:
+        os.unlink(os.path.join(directory, name))
+
+
+def list_snapshots(directory):
+    """
+    Return the ids of the snapshots in directory, oldest first.
+    """
+    if not os.path.isdir(directory):
+        return []
+    return sorted(name[:-len('.json')] for name in os.listdir(directory)
+                  if name.endswith('.json') and
+                  SNAPSHOT_ID.match(name[:-len('.json')]))
+
+
+def read_snapshot(directory, snapshot_id):
+    """
+    Load a snapshot by id, raising TracError when there is no such
+    snapshot.
+    """
+    path = os.path.join(directory, snapshot_id + '.json')
+    if not SNAPSHOT_ID.match(snapshot_id) or not os.path.isfile(path):
+        raise TracError('No ticket field snapshot %s' % snapshot_id)
+    with open(path, 'rb') as f:
+        return json.loads(f.read().decode('utf-8'))
+
+
+def restore_snapshot(db, snapshot):
+    """
+    Replace the rows saved in a snapshot with their saved state: every
+    enum type in it and every table saved whole.
+    """
+    enum_types = list(snapshot['enum'])
+    if enum_types:
+        db("DELETE FROM enum WHERE type IN (%s)"
+           % ','.join(['%s'] * len(enum_types)), enum_types)
+        # snapshots written before descriptions were saved hold
+        # [name, value] rows
+        db.executemany("INSERT INTO enum (type, %s) VALUES (%s)"
+                       % (', '.join(ENUM_COLUMNS),
+                          ','.join(['%s'] * (len(ENUM_COLUMNS) + 1))),
+                       [(enum_type,) + tuple(row) +
+                        (None,) * (len(ENUM_COLUMNS) - len(row))
+                        for enum_type, rows in snapshot['enum'].items()
+                        for row in rows])
+    for table, columns in sorted(TABLE_COLUMNS.items()):
+        if table in snapshot:
+            db("DELETE FROM %s" % table)
+            db.executemany("INSERT INTO %s (%s) VALUES (%s)"
+                           % (table, ', '.join(columns),
+                              ','.join(['%s'] * len(columns))),
+                           [tuple(row) for row in snapshot[table]])
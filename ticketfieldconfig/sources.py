@@ -0,0 +1,102 @@
+"""
+Field values read from files named by '<field>_file' options, for lists too
+long to keep on one comma separated line of trac.ini:
+
+ [ticket-field-config]
+ component_file = /etc/trac/components.jsonl
+ priority_file = priorities.csv
+
+JSON Lines files (.jsonl, .ndjson) hold one value per line, either a string
+or an object such as {"name": "webapp/www", "owner": "alice"}.  CSV files
+(.csv) hold one value per row, optionally followed by the owner.  The owner
+only applies to components.
+
+Files are read line by line.  Their content digest is part of the config
+fingerprint, so an unchanged file is hashed but never parsed.
+"""
+
+import csv
+import hashlib
+import io
+import json
+import os
+import sys
+
+from trac.core import TracError
+
+JSON_LINES_EXTENSIONS = ('.jsonl', '.ndjson')
+CSV_EXTENSIONS = ('.csv',)
+
+READ_SIZE = 64 * 1024
+
+
+def _check_file(path):
+    extension = os.path.splitext(path)[1].lower()
+    if extension not in JSON_LINES_EXTENSIONS + CSV_EXTENSIONS:
+        raise TracError('Unsupported field value file %s, expected one of %s'
+                        % (path, ', '.join(JSON_LINES_EXTENSIONS +
+                                           CSV_EXTENSIONS)))
+    if not os.path.isfile(path):
+        raise TracError('Field value file %s not found' % path)
+    return extension
+
+
+def file_digest(path):
+    """
+    Return the sha1 of a value file, read in fixed size blocks.
+    """
+    _check_file(path)
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(READ_SIZE), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _json_lines_rows(path):
+    with io.open(path, encoding='utf-8') as f:
+        for number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError:
+                raise TracError('Invalid JSON on line %d of %s'
+                                % (number, path))
+            if isinstance(row, dict):
+                yield number, row.get('name'), row.get('owner')
+            else:
+                yield number, row, None
+
+
+def _csv_rows(path):
+    if sys.version_info[0] < 3:
+        f = open(path, 'rb')
+        decode = lambda cell: cell.decode('utf-8')
+    else:
+        f = io.open(path, encoding='utf-8', newline='')
+        decode = lambda cell: cell
+    with f:
+        for number, row in enumerate(csv.reader(f), 1):
+            row = [decode(cell).strip() for cell in row]
+            if not any(row):
+                continue
+            yield number, row[0], row[1] if len(row) > 1 and row[1] else None
+
+
+def read_field_file(path):
+    """
+    Yield the (name, owner) rows of a value file, owner is None when the
+    row has none.  Raises TracError for rows without a name.
+    """
+    if _check_file(path) in CSV_EXTENSIONS:
+        rows = _csv_rows(path)
+    else:
+        rows = _json_lines_rows(path)
+
+    for number, name, owner in rows:
+        if not name or not isinstance(name, type(u'')):
+            raise TracError('Missing value name on line %d of %s'
+                            % (number, path))
+        yield name.strip(), owner
@@ -0,0 +1,445 @@
+"""
+Batched database reads and writes used by TicketFieldConfigCommand to bring
+the ticket field tables in line with the [ticket-field-config] section.
+
+Nothing in here commits on its own.  Every function is handed a database
+connection by the caller so that a whole apply runs in one transaction.
+"""
+
+from bisect import bisect_left
+from contextlib import contextmanager
+from datetime import datetime
+import calendar
+import time
+
+from ticketfieldcommon.api import CUSTOM_PREFIX
+from ticketfieldcommon.api import TICKET_COLUMNS
+
+# date columns of the fields stored in a table of their own, the dates are
+# microsecond timestamps in the database and YYYY-MM-DD dates (UTC) here
+DATE_COLUMNS = {
+    'milestone': ('due', 'completed'),
+    'version': ('time',),
+}
+
+DATE_FORMAT = '%Y-%m-%d'
+
+# The bulk statements below bind a handful of parameters per row, keep each
+# statement comfortably under the SQLite default of 999 bound parameters.
+CHUNK_SIZE = 300
+
+
+class StatementCounter(object):
+    """
+    Wrap a Trac database connection and count the statements sent through
+    it, so an apply can report how much work it did.
+
+    When given a profile dictionary, the wall time and statement count of
+    each phase() are accumulated in it as profile[field][phase].
+    """
+
+    def __init__(self, db, profile=None):
+        self.db = db
+        self.count = 0
+        self.profile = profile
+
+    @contextmanager
+    def phase(self, field_name, phase_name):
+        if self.profile is None:
+            yield
+            return
+
+        started = time.time()
+        count = self.count
+        try:
+            yield
+        finally:
+            entry = self.profile.setdefault(field_name, {}).setdefault(
+                phase_name, {'seconds': 0.0, 'statements': 0})
+            entry['seconds'] = round(
+                entry['seconds'] + time.time() - started, 6)
+            entry['statements'] += self.count - count
+
+    def __call__(self, sql, params=None):
+        self.count += 1
+        return self.db(sql, params)
+
+    def executemany(self, sql, params):
+        params = list(params)
+        if params:
+            self.count += 1
+            self.db.executemany(sql, params)
+
+
+def chunks(values, size=CHUNK_SIZE):
+    """
+    Yield successive slices of at most size items from a list.
+    """
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
+
+
+def position(value):
+    """
+    Return the integer position of an enum value column, which Trac stores
+    as text.  Unparseable values sort as position 0 so they get rewritten.
+    """
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return 0
+
+
+def longest_increasing_run(sequence):
+    """
+    Return the longest strictly increasing subsequence of a list of integers
+    in O(n log n).  Used to find the values which are already in order so
+    only the others are reported as moved.
+    """
+    tails = []          # smallest tail value of a run of each length
+    tail_indexes = []   # index in sequence of each of those tails
+    previous = [None] * len(sequence)
+
+    for index, item in enumerate(sequence):
+        length = bisect_left(tails, item)
+        if length > 0:
+            previous[index] = tail_indexes[length - 1]
+        if length == len(tails):
+            tails.append(item)
+            tail_indexes.append(index)
+        else:
+            tails[length] = item
+            tail_indexes[length] = index
+
+    run = []
+    index = tail_indexes[-1] if tail_indexes else None
+    while index is not None:
+        run.append(sequence[index])
+        index = previous[index]
+    run.reverse()
+    return run
+
+
+class FieldChanges(object):
+    """
+    The difference between the values of one ticket field stored in the
+    database and the values declared for it in the config file.
+
+    db_rows is the ordered list of (name, position) tuples in the database,
+    position is None for fields which are not ordered (components).
+
+    renames is a list of (old, new) names.  A rename whose old value exists
+    renames that row in place, or merges it into new when new exists too,
+    and in both cases moves the tickets using old over to new.
+
+    attributes maps config values to the attributes they should have, for
+    fields which are not ordered: the owner of a component, or a dictionary
+    of the declared dates of a milestone.  db_rows then hold the stored
+    attributes in place of the position.  Changes are reported under
+    '<attribute_label> changed'.
+    """
+
+    def __init__(self, field_name, db_rows, config_values, ordered=True,
+                 renames=(), attributes=None, attribute_label='Owner'):
+        self.field_name = field_name
+        self.ordered = ordered
+
+        # (old, new) renames to apply, and the subset of them whose new
+        # value already exists so the old row is removed instead
+        self.renamed = []
+        self.merged = []
+        for old, new in renames:
+            names = set(name for name, value in db_rows)
+            if old in names and old != new:
+                self.renamed.append((old, new))
+                if new in names:
+                    self.merged.append((old, new))
+                else:
+                    db_rows = [(new if name == old else name, value)
+                               for name, value in db_rows]
+
+        self.db_values = [name for name, value in db_rows]
+        self.config_values = list(config_values)
+        self.attributes = attributes or {}
+        self.attribute_label = attribute_label
+
+        db_names = set(self.db_values)
+        config_names = set(self.config_values)
+
+        self.removed = [v for v in self.db_values if v not in config_names]
+        self.added = [v for v in self.config_values if v not in db_names]
+
+        # name -> 1 based position declared in the config file
+        self.positions = dict((name, index + 1) for index, name
+                              in enumerate(self.config_values))
+
+        # (name, old, new) attributes of every kept row which drifted
+        self.attributes_changed = []
+        for name, stored in db_rows:
+            wanted = self.attributes.get(name)
+            if wanted is not None:
+                stored = declared_attributes(wanted, stored)
+                if stored != wanted:
+                    self.attributes_changed.append((name, stored, wanted))
+
+        # (name, position) for every existing row that needs a new position
+        self.repositioned = []
+        # existing values which moved relative to the values around them
+        self.reordered = None
+
+        if ordered:
+            for name, value in db_rows:
+                if (name in self.positions and
+                        position(value) != self.positions[name]):
+                    self.repositioned.append((name, self.positions[name]))
+
+            kept = [self.positions[v] for v in self.db_values
+                    if v in config_names]
+            in_place = set(longest_increasing_run(kept))
+            if len(in_place) != len(kept):
+                self.reordered = [name for name in self.config_values
+                                  if name in db_names and
+                                  self.positions[name] not in in_place]
+
+    def __nonzero__(self):
+        return bool(self.added or self.removed or self.repositioned or
+                    self.renamed or self.attributes_changed)
+
+    __bool__ = __nonzero__
+
+    def comment(self):
+        """
+        Return the JSON friendly description of the changes, or None when the
+        field is reported as unchanged.
+        """
+        if not (self.added or self.removed or self.reordered or
+                self.renamed or self.attributes_changed):
+            return None
+        comment = {
+            'Added': self.added,
+            'Removed': self.removed,
+            'Reordered': self.reordered,
+        }
+        if self.renamed:
+            comment['Renamed'] = dict(self.renamed)
+        if self.attributes_changed:
+            comment['%s changed' % self.attribute_label] = dict(
+                (name, [old, new])
+                for name, old, new in self.attributes_changed)
+        return comment
+
+
+def declared_attributes(wanted, stored):
+    """
+    Return the part of the stored attributes the config declares: all of a
+    single value, or the declared keys of a dictionary.
+    """
+    if isinstance(wanted, dict):
+        return dict((key, stored.get(key)) for key in wanted)
+    return stored
+
+
+def date_to_timestamp(date):
+    """
+    Return the microsecond timestamp of midnight UTC of a YYYY-MM-DD date,
+    raises ValueError for anything else.
+    """
+    parsed = datetime.strptime(date, DATE_FORMAT)
+    return calendar.timegm(parsed.timetuple()) * 1000000
+
+
+def timestamp_to_date(timestamp):
+    """
+    Return the YYYY-MM-DD date (UTC) of a microsecond timestamp, None for
+    an unset one.
+    """
+    if not timestamp:
+        return None
+    return time.strftime(DATE_FORMAT, time.gmtime(timestamp // 1000000))
+
+
+def select_enum_rows(db, enum_types):
+    """
+    Return a dictionary of ordered (name, value) rows for each of the given
+    enum types, read with a single query.
+    """
+    enum_rows = dict((enum_type, []) for enum_type in enum_types)
+    for enum_type, name, value in db("""
+            SELECT type, name, value FROM enum WHERE type IN (%s)
+            """ % ','.join(['%s'] * len(enum_rows)), list(enum_rows)):
+        enum_rows[enum_type].append((name, value))
+
+    for rows in enum_rows.values():
+        rows.sort(key=lambda row: position(row[1]))
+    return enum_rows
+
+
+def select_component_rows(db):
+    """
+    Return the list of (name, owner) rows of the component table.
+    """
+    return list(db("SELECT name, owner FROM component ORDER BY name"))
+
+
+def select_dated_rows(db, table):
+    """
+    Return the list of (name, {date column: date}) rows of the milestone
+    or version table.
+    """
+    columns = DATE_COLUMNS[table]
+    return [(row[0], dict(zip(columns, map(timestamp_to_date, row[1:]))))
+            for row in db("SELECT name, %s FROM %s ORDER BY name"
+                          % (', '.join(columns), table))]
+
+
+def delete_enums(db, enum_type, names):
+    db.executemany("DELETE FROM enum WHERE type=%s AND name=%s",
+                   [(enum_type, name) for name in names])
+
+
+def insert_enums(db, enum_type, rows):
+    """
+    Insert (name, position) rows for an enum type.
+    """
+    db.executemany("INSERT INTO enum (type, name, value) VALUES (%s,%s,%s)",
+                   [(enum_type, name, str(pos)) for name, pos in rows])
+
+
+def update_enum_positions(db, enum_type, rows):
+    """
+    Move (name, position) rows of an enum type with one UPDATE per chunk.
+    """
+    for chunk in chunks(rows):
+        cases = ' '.join(['WHEN %s THEN %s'] * len(chunk))
+        names = ','.join(['%s'] * len(chunk))
+        params = []
+        for name, pos in chunk:
+            params.extend((name, str(pos)))
+        params.append(enum_type)
+        params.extend(name for name, pos in chunk)
+        db("UPDATE enum SET value=CASE name %s END "
+           "WHERE type=%%s AND name IN (%s)" % (cases, names), params)
+
+
+def delete_named(db, table, names):
+    """
+    Delete rows by name from the component, milestone or version table.
+    """
+    db.executemany("DELETE FROM %s WHERE name=%%s" % table,
+                   [(name,) for name in names])
+
+
+def insert_components(db, names, owner, owners=None):
+    """
+    Insert components owned by owners[name], or by owner when they have no
+    entry there.
+    """
+    owners = owners or {}
+    db.executemany("INSERT INTO component (name, owner) VALUES (%s,%s)",
+                   [(name, owners.get(name, owner)) for name in names])
+
+
+def insert_dated(db, table, names, dates):
+    """
+    Insert milestones or versions with the dates in dates[name], the
+    dates not given are left unset.
+    """
+    columns = DATE_COLUMNS[table]
+    rows = []
+    for name in names:
+        declared = dates.get(name, {})
+        rows.append([name] + [date_to_timestamp(declared[column])
+                              if declared.get(column) else 0
+                              for column in columns])
+    db.executemany("INSERT INTO %s (name, %s) VALUES (%s)"
+                   % (table, ', '.join(columns),
+                      ','.join(['%s'] * (len(columns) + 1))), rows)
+
+
+def update_column(db, table, column, rows):
+    """
+    Set column of (name, value) rows of a table keyed by name, with one
+    UPDATE per chunk.
+    """
+    for chunk in chunks(rows):
+        cases = ' '.join(['WHEN %s THEN %s'] * len(chunk))
+        names = ','.join(['%s'] * len(chunk))
+        params = []
+        for name, value in chunk:
+            params.extend((name, value))
+        params.extend(name for name, value in chunk)
+        db("UPDATE %s SET %s=CASE name %s END WHERE name IN (%s)"
+           % (table, column, cases, names), params)
+
+
+def update_dates(db, table, rows):
+    """
+    Set the declared dates of (name, {date column: date}) rows of the
+    milestone or version table, with one UPDATE per column and chunk.
+    """
+    for column in DATE_COLUMNS[table]:
+        update_column(db, table, column,
+                      [(name, date_to_timestamp(dates[column])
+                        if dates[column] else 0)
+                       for name, dates in rows if column in dates])
+
+
+def rename_enum(db, enum_type, old, new):
+    db("UPDATE enum SET name=%s WHERE type=%s AND name=%s",
+       (new, enum_type, old))
+
+
+def rename_named(db, table, old, new):
+    """
+    Rename a row of the component, milestone or version table.
+    """
+    db("UPDATE %s SET name=%%s WHERE name=%%s" % table, (new, old))
+
+
+def remap_tickets(db, field_name, old, new, history=None):
+    """
+    Point every ticket using old at new with one set based UPDATE.
+
+    history is None or an (author, time) tuple, in which case a
+    ticket_change row is written for every affected ticket with one
+    INSERT ... SELECT and the tickets changetime is updated.
+    """
+    if field_name.startswith(CUSTOM_PREFIX):
+        remap_custom(db, field_name[len(CUSTOM_PREFIX):], old, new, history)
+        return
+
+    column = TICKET_COLUMNS[field_name]
+    if history is None:
+        db("UPDATE ticket SET %s=%%s WHERE %s=%%s" % (column, column),
+           (new, old))
+        return
+
+    author, when = history
+    db("""
+        INSERT INTO ticket_change
+            (ticket, time, author, field, oldvalue, newvalue)
+        SELECT id, %%s, %%s, %%s, %%s, %%s FROM ticket WHERE %s=%%s
+        """ % column, (when, author, column, old, new, old))
+    db("UPDATE ticket SET %s=%%s, changetime=%%s WHERE %s=%%s"
+       % (column, column), (new, when, old))
+
+
+def remap_custom(db, name, old, new, history=None):
+    """
+    Point every ticket whose custom field name is old at new with one set
+    based UPDATE of ticket_custom, history as for remap_tickets().
+    """
+    if history is not None:
+        author, when = history
+        db("""
+            INSERT INTO ticket_change
+                (ticket, time, author, field, oldvalue, newvalue)
+            SELECT ticket, %s, %s, %s, %s, %s FROM ticket_custom
+            WHERE name=%s AND value=%s
+            """, (when, author, name, old, new, name, old))
+        db("""
+            UPDATE ticket SET changetime=%s WHERE id IN (
+                SELECT ticket FROM ticket_custom WHERE name=%s AND value=%s)
+            """, (when, name, old))
+    db("UPDATE ticket_custom SET value=%s WHERE name=%s AND value=%s",
+       (new, name, old))
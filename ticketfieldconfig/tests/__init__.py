@@ -1 +1,4 @@
 from .ticketfieldconfigtests import *
+from .fleettests import *
+from .watchtests import *
+from .locktests import *
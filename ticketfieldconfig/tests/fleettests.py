@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from trac.env import Environment
+from trac.env import open_environment
+from trac.ticket.admin import PriorityAdminPanel
+
+from ticketfieldconfig import fleet
+
+class FleetTests(unittest.TestCase):
+
+    def setUp(self):
+        """Create a parent directory holding two Trac environments"""
+        self.parent = tempfile.mkdtemp()
+        self.priority = ['P1', 'P2', 'P3']
+        for name in ('one', 'two'):
+            Environment(os.path.join(self.parent, name), create=True,
+                        options=[('ticket-field-config', 'priority',
+                                  ','.join(self.priority))])
+        # a directory which is not a Trac environment is ignored
+        os.mkdir(os.path.join(self.parent, 'not-an-env'))
+
+    def tearDown(self):
+        shutil.rmtree(self.parent)
+
+    def _run(self, paths):
+        lines = []
+
+        class Out(object):
+            def write(self, data):
+                lines.append(data)
+            def flush(self):
+                pass
+
+        failures = fleet.run(paths, jobs=2, out=Out())
+        results = [json.loads(line) for line in lines]
+        return failures, dict((r['env'], r) for r in results)
+
+    def test_find_environments(self):
+        """only directories holding a trac.ini are environments"""
+        self.assertEqual(fleet.find_environments(self.parent),
+                         [os.path.join(self.parent, 'one'),
+                          os.path.join(self.parent, 'two')])
+
+    def test_fleet_converges_every_environment(self):
+        """every environment is converged and reported on its own line"""
+        paths = fleet.find_environments(self.parent)
+        failures, results = self._run(paths)
+
+        self.assertEqual(failures, 0)
+        self.assertItemsEqual(results.keys(), paths)
+        for path in paths:
+            self.assertTrue(results[path]['changed'])
+            env = open_environment(path)
+            self.assertEqual(PriorityAdminPanel(env).get_enum_list(),
+                             self.priority)
+            env.shutdown()
+
+    def test_failed_environment_is_reported(self):
+        """a broken environment is reported and counted as a failure"""
+        missing = os.path.join(self.parent, 'missing')
+        paths = fleet.find_environments(self.parent) + [missing]
+        failures, results = self._run(paths)
+
+        self.assertEqual(failures, 1)
+        self.assertTrue('error' in results[missing])
+        self.assertFalse('error' in results[paths[0]])
+
+    def test_main_exit_code(self):
+        """main exits nonzero when an environment fails"""
+        missing = os.path.join(self.parent, 'missing')
+        self.assertEqual(fleet.main(['--jobs', '1', missing]), 1)
+
+    def test_drift_report(self):
+        """
+        the drift matrix shows which fields of which environments differ
+        from their config, and the environments which failed
+        """
+        one, two = fleet.find_environments(self.parent)
+        missing = os.path.join(self.parent, 'missing')
+        self._run([one])
+
+        report = fleet.drift_report([one, two, missing], jobs=2)
+
+        self.assertEqual(report['fields'], ['priority'])
+        self.assertEqual(report['environments'], {one: [False], two: [True]})
+        self.assertEqual(list(report['errors']), [missing])
@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from trac.core import TracError
+from trac.env import Environment
+from trac.env import open_environment
+
+from ticketfieldconfig import TicketFieldConfigCommand
+from ticketfieldconfig.lock import env_lock
+
+class EnvLockTests(unittest.TestCase):
+
+    def setUp(self):
+        """Create a SQLite Trac environment configuring the priorities"""
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'env')
+        Environment(self.path, create=True,
+                    options=[('ticket-field-config', 'priority', 'P1,P2,P3'),
+                             ('ticket-field-config', 'lock_timeout', '5')])
+        self.env = open_environment(self.path, use_cache=False)
+
+    def tearDown(self):
+        self.env.shutdown()
+        shutil.rmtree(self.dir)
+
+    def test_timeout(self):
+        """a run gives up with TracError once lock_timeout has passed"""
+        self.env.config.set('ticket-field-config', 'lock_timeout', '0.2')
+        admin_command = TicketFieldConfigCommand(self.env)
+
+        with env_lock(self.env):
+            self.assertRaises(TracError,
+                              admin_command.apply_fields_from_config)
+        self.assertTrue(admin_command.apply_fields_from_config()['changed'])
+
+    def test_waiting_run_rechecks_fingerprint(self):
+        """
+        a run which waited for the lock finds the environment converged by
+        the run holding it and only checks the fingerprint
+        """
+        results = []
+        other = open_environment(self.path, use_cache=False)
+        waiting = threading.Thread(target=lambda: results.append(
+            TicketFieldConfigCommand(other).apply_fields_from_config()))
+
+        admin_command = TicketFieldConfigCommand(self.env)
+        with env_lock(self.env):
+            waiting.start()
+            # converge while holding the lock, as a concurrent run would
+            result = admin_command._apply_fields_from_config(
+                False, False, False, None)
+            self.assertTrue(result['changed'])
+        waiting.join()
+        other.shutdown()
+
+        self.assertFalse(results[0]['changed'])
+        # the stored fingerprint plus one stamp query per table
+        self.assertEqual(results[0]['statements'], 5)
@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+"""
+Measure what loading this plugin costs trac-admin commands which are not
+provided by it, such as 'trac-admin resync' or 'trac-admin help'.
+
+Run with:
+
+ python -m ticketfieldconfig.tests.startupbench
+
+Prints a JSON document with the import time and modules pulled in by the
+plugin modules in a fresh interpreter (on top of trac.admin.console, which
+trac-admin always loads), and the time taken to create the plugin
+components and list their commands.
+"""
+
+import json
+import subprocess
+import sys
+import time
+
+IMPORT_SCRIPT = """
+import json, sys, time
+import trac.admin.console
+before = set(sys.modules)
+started = time.time()
+import ticketfieldconfig
+import jsontracadmin.jsontracadmin
+elapsed = time.time() - started
+print(json.dumps({'seconds': elapsed,
+                  'modules': sorted(set(sys.modules) - before)}))
+"""
+
+
+def measure_import():
+    output = subprocess.check_output([sys.executable, '-c', IMPORT_SCRIPT])
+    return json.loads(output.decode('utf-8'))
+
+
+def measure_activation(number=200):
+    from trac.test import EnvironmentStub
+    from ticketfieldconfig import TicketFieldConfigCommand
+    from jsontracadmin.jsontracadmin import JsonAdminCommandProvider
+
+    # components are singletons per environment, so every activation
+    # needs an environment of its own, created outside of the timing
+    envs = [EnvironmentStub() for i in range(number)]
+
+    started = time.time()
+    for env in envs:
+        for cls in (TicketFieldConfigCommand, JsonAdminCommandProvider):
+            list(cls(env).get_admin_commands())
+    elapsed = time.time() - started
+
+    return {'iterations': number, 'seconds_per_activation': elapsed / number}
+
+
+def main():
+    imported = measure_import()
+    trac_modules = [m for m in imported['modules'] if m.startswith('trac.')]
+    print(json.dumps({
+        'import_seconds': imported['seconds'],
+        'imported_trac_modules': trac_modules,
+        'activation': measure_activation(),
+    }, indent=2, sort_keys=True))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,242 @@
+#!/usr/bin/env python
+"""
+Measure 'set fields from config' and the jsontracadmin commands against
+SQLite backed Trac environments holding many field values and tickets.
+
+Run with:
+
+ python -m ticketfieldconfig.tests.syncbench
+ python -m ticketfieldconfig.tests.syncbench --sizes 10,1000 --tickets 10000 \\
+     --output bench.json
+
+For every size a fresh environment is created with that many values for
+each enum field and for components (read from a component_file), and a
+ticket table using them.  Then, in order, it times:
+
+ * cold_bootstrap, the first apply replacing the default values
+ * noop, an apply skipped on the fingerprint
+ * noop_forced, an apply with --force that finds nothing to change
+ * every jsontracadmin command, as a JSON list and streamed
+ * heavy_reorder, an apply reversing every list
+ * heavy_removal, an apply removing nine values out of ten
+
+Each measurement records the wall time and the number of SQL statements
+executed.  The JSON document written holds the versions involved, so the
+results of two plugin releases can be compared.
+"""
+
+import argparse
+import contextlib
+import json
+import os
+import platform
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
+
+ENUM_FIELDS = ('priority', 'severity', 'resolution', 'ticket_type')
+SECTION_NAME = 'ticket-field-config'
+TICKET_CHUNK_SIZE = 10000
+
+
+@contextlib.contextmanager
+def count_statements():
+    """
+    Count the statements sent through Trac database cursors, the count is
+    in the yielded dictionary under 'statements'.
+    """
+    from trac.db.util import IterableCursor
+
+    counter = {'statements': 0}
+    execute = IterableCursor.execute
+    executemany = IterableCursor.executemany
+
+    def counted_execute(self, *args, **kwargs):
+        counter['statements'] += 1
+        return execute(self, *args, **kwargs)
+
+    def counted_executemany(self, *args, **kwargs):
+        counter['statements'] += 1
+        return executemany(self, *args, **kwargs)
+
+    IterableCursor.execute = counted_execute
+    IterableCursor.executemany = counted_executemany
+    try:
+        yield counter
+    finally:
+        IterableCursor.execute = execute
+        IterableCursor.executemany = executemany
+
+
+def values(field_name, size):
+    return ['%s %05d' % (field_name, i) for i in range(size)]
+
+
+def create_environment(path, size, tickets):
+    """
+    Create a SQLite environment and fill its ticket table with tickets
+    using the values the benchmark configures.
+    """
+    from trac.env import Environment
+
+    env = Environment(path, create=True, options=[
+        ('trac', 'database', 'sqlite:db/trac.db'),
+        ('components', 'ticketfieldconfig.*', 'enabled'),
+        ('components', 'jsontracadmin.*', 'enabled'),
+    ])
+
+    columns = dict((field_name, values(field_name, size))
+                   for field_name in ENUM_FIELDS + ('component',))
+    with env.db_transaction as db:
+        for start in range(0, tickets, TICKET_CHUNK_SIZE):
+            db.executemany("""
+                INSERT INTO ticket (id, type, time, changetime, component,
+                                    severity, priority, status, resolution,
+                                    summary)
+                VALUES (%s,%s,%s,%s,%s,%s,%s,%s,%s,%s)
+                """, [(i + 1, columns['ticket_type'][i % size], 0, 0,
+                       columns['component'][i % size],
+                       columns['severity'][i % size],
+                       columns['priority'][i % size], 'closed',
+                       columns['resolution'][i % size], 'ticket %d' % i)
+                      for i in range(start, min(start + TICKET_CHUNK_SIZE,
+                                                tickets))])
+    return env
+
+
+def configure(env, field_values):
+    """
+    Set the enum values inline and write the components to a JSON Lines
+    value file.
+    """
+    path = os.path.join(env.path, 'components.jsonl')
+    with open(path, 'w') as f:
+        for name in field_values['component']:
+            f.write(json.dumps({'name': name, 'owner': 'bench'}) + '\n')
+
+    env.config.set(SECTION_NAME, 'component_owner', 'bench')
+    env.config.set(SECTION_NAME, 'component_file', path)
+    for field_name in ENUM_FIELDS:
+        env.config.set(SECTION_NAME, field_name,
+                       ','.join(field_values[field_name]))
+
+
+def measure_apply(command, force=False):
+    with count_statements() as counter:
+        started = time.time()
+        result = command.apply_fields_from_config(force=force)
+        elapsed = time.time() - started
+    return {'seconds': elapsed, 'statements': counter['statements'],
+            'reported_statements': result['statements'],
+            'changed': result['changed']}
+
+
+def measure_json_commands(env):
+    from jsontracadmin.jsontracadmin import JsonAdminCommandProvider
+
+    results = {}
+    for command in JsonAdminCommandProvider(env).get_admin_commands():
+        variants = [()]
+        if '--stream' in command[1]:
+            variants.append(('--stream',))
+        for args in variants:
+            name = ' '.join((command[0],) + args)
+            stdout = sys.stdout
+            sys.stdout = StringIO()
+            try:
+                with count_statements() as counter:
+                    started = time.time()
+                    command[4](*args)
+                    elapsed = time.time() - started
+                output = len(sys.stdout.getvalue())
+            finally:
+                sys.stdout = stdout
+            results[name] = {'seconds': elapsed,
+                             'statements': counter['statements'],
+                             'output_bytes': output}
+    return results
+
+
+def run_size(directory, size, tickets):
+    from ticketfieldconfig import TicketFieldConfigCommand
+
+    started = time.time()
+    env = create_environment(os.path.join(directory, 'env%d' % size), size,
+                             tickets)
+    results = {'values': size, 'tickets': tickets,
+               'setup_seconds': time.time() - started}
+    try:
+        command = TicketFieldConfigCommand(env)
+        field_values = dict((field_name, values(field_name, size))
+                            for field_name in ENUM_FIELDS + ('component',))
+
+        configure(env, field_values)
+        results['cold_bootstrap'] = measure_apply(command)
+        results['noop'] = measure_apply(command)
+        results['noop_forced'] = measure_apply(command, force=True)
+        results['json_commands'] = measure_json_commands(env)
+
+        configure(env, dict((field_name, list(reversed(names)))
+                            for field_name, names in field_values.items()))
+        results['heavy_reorder'] = measure_apply(command)
+
+        configure(env, dict((field_name, names[::10])
+                            for field_name, names in field_values.items()))
+        results['heavy_removal'] = measure_apply(command)
+    finally:
+        env.shutdown()
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Benchmark set fields from config on SQLite.')
+    parser.add_argument('--sizes', default='10,1000,50000',
+                        help='comma separated numbers of values per field '
+                             '(default: 10,1000,50000)')
+    parser.add_argument('--tickets', type=int, default=100000,
+                        help='number of tickets per environment '
+                             '(default: 100000)')
+    parser.add_argument('--output', help='write the results to this file '
+                                         'instead of stdout')
+    options = parser.parse_args(argv)
+
+    import trac
+    results = {
+        'python': platform.python_version(),
+        'sqlite': sqlite3.sqlite_version,
+        'trac': trac.__version__,
+        'sizes': [],
+    }
+    try:
+        import pkg_resources
+        results['plugin'] = pkg_resources.get_distribution(
+            'TicketFieldConfigPlugin').version
+    except Exception:
+        results['plugin'] = None
+
+    directory = tempfile.mkdtemp()
+    try:
+        for size in [int(size) for size in options.sizes.split(',')]:
+            results['sizes'].append(run_size(directory, size,
+                                             options.tickets))
+    finally:
+        shutil.rmtree(directory)
+
+    document = json.dumps(results, indent=2, sort_keys=True)
+    if options.output:
+        with open(options.output, 'w') as f:
+            f.write(document + '\n')
+    else:
+        print(document)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,7 +1,17 @@
 #!/usr/bin/env python
 
+import json
+import os
+import shutil
+import sys
+import tempfile
 import unittest
 
+try:
+    from StringIO import StringIO
+except ImportError:
+    from io import StringIO
+
 from trac.test import EnvironmentStub
 
 from trac.ticket.admin import PriorityAdminPanel
@@ -11,6 +21,7 @@ from trac.ticket.admin import TicketTypeAdminPanel
 from trac.ticket.admin import ComponentAdminPanel
 
 from trac.core import TracError
+from trac.ticket.model import Ticket
 
 from ticketfieldconfig import TicketFieldConfigCommand
 
@@ -19,7 +30,8 @@ class TicketFieldConfigCommandTests(unittest.TestCase):
     def setUp(self):
         """Create Trac env with default_data and our component enabled"""
         self.env = EnvironmentStub(default_data=True,
-                                   enable=['ticket-field-config.*'])
+                                   enable=['ticket-field-config.*'],
+                                   path=tempfile.mkdtemp())
 
         # this is the default data that is in the test Trac database
         self.default = {
@@ -39,6 +51,9 @@ class TicketFieldConfigCommandTests(unittest.TestCase):
           'component': ['new/blog','new/site','old/blog','old/site'],
         }
 
+    def tearDown(self):
+        shutil.rmtree(self.env.path)
+
     def test_priority_set_successful(self):
         """
         When we add custom priority enum values to the config
@@ -347,4 +362,845 @@ class TicketFieldConfigCommandTests(unittest.TestCase):
         # assert order was adjusted
         self.assertEqual(panel.get_enum_list(), self.new['resolution'])
 
+    def test_apply_reports_statement_count(self):
+        """
+        all field changes are written with batched statements and the number
+        of statements issued is reported
+        """
+        self.env.config.set('ticket-field-config', 'priority',
+                            ','.join(self.new['priority']))
+        self.env.config.set('ticket-field-config', 'ticket_type',
+                            ','.join(self.new['ticket_type']))
+
+        admin_command = TicketFieldConfigCommand(self.env)
+        result = admin_command.apply_fields_from_config(force=True)
+
+        self.assertTrue(result['changed'])
+        # one enum read and one snapshot read, one delete and one insert
+        # batch per field, then four table reads and two writes to store the
+        # fingerprint
+        self.assertEqual(result['statements'], 12)
+        self.assertEqual(PriorityAdminPanel(self.env).get_enum_list(),
+                         self.new['priority'])
+        self.assertEqual(TicketTypeAdminPanel(self.env).get_enum_list(),
+                         self.new['ticket_type'])
+
+    def test_failed_apply_leaves_database_untouched(self):
+        """
+        a failure partway through an apply rolls back every field
+        """
+        self.env.config.set('ticket-field-config', 'priority',
+                            ','.join(self.new['priority']))
+        self.env.config.set('ticket-field-config', 'resolution',
+                            ','.join(self.new['resolution']))
+
+        admin_command = TicketFieldConfigCommand(self.env)
+
+        def fail(db, field_changes):
+            raise TracError('boom')
+        admin_command._reorder_values_in_db = fail
+
+        self.assertRaises(TracError, admin_command.set_fields_from_config)
+
+        self.assertEqual(PriorityAdminPanel(self.env).get_enum_list(),
+                         self.default['priority'])
+        self.assertEqual(ResolutionAdminPanel(self.env).get_enum_list(),
+                         self.default['resolution'])
+        # no snapshot of the rolled back apply
+        self.assertEqual(self._printed(admin_command.list_fields_snapshots),
+                         [])
+
+    def test_reorder_reports_only_moved_values(self):
+        """
+        moving one value to the front reports just that value as reordered
+        and rewrites the shifted positions with a single UPDATE
+        """
+        resolution = ['worksforme', 'fixed', 'invalid', 'wontfix', 'duplicate']
+        self.env.config.set('ticket-field-config', 'resolution',
+                            ','.join(resolution))
+
+        admin_command = TicketFieldConfigCommand(self.env)
+        result = admin_command.apply_fields_from_config(force=True)
+
+        self.assertEqual(result['comment']['resolution']['Reordered'],
+                         ['worksforme'])
+        # one read, one snapshot read and one bulk update, plus storing the
+        # fingerprint
+        self.assertEqual(result['statements'], 9)
+        self.assertEqual(ResolutionAdminPanel(self.env).get_enum_list(),
+                         resolution)
+
+    def test_converged_run_is_skipped(self):
+        """
+        a second run against unchanged config and tables only checks the
+        stored fingerprint, unless forced
+        """
+        self.env.config.set('ticket-field-config', 'priority',
+                            ','.join(self.new['priority']))
+
+        admin_command = TicketFieldConfigCommand(self.env)
+        self.assertTrue(admin_command.apply_fields_from_config()['changed'])
+
+        result = admin_command.apply_fields_from_config()
+        self.assertFalse(result['changed'])
+        # the stored fingerprint plus one stamp query per table
+        self.assertEqual(result['statements'], 5)
+
+        result = admin_command.apply_fields_from_config(force=True)
+        self.assertFalse(result['changed'])
+        self.assertTrue(result['statements'] > 3)
+
+    def test_table_change_invalidates_fingerprint(self):
+        """
+        a value added outside of this plugin is removed again on the next run
+        """
+        self.env.config.set('ticket-field-config', 'priority',
+                            ','.join(self.new['priority']))
+
+        admin_command = TicketFieldConfigCommand(self.env)
+        admin_command.apply_fields_from_config()
+
+        panel = PriorityAdminPanel(self.env)
+        panel._do_add('P4')
+
+        result = admin_command.apply_fields_from_config()
+        self.assertEqual(result['comment']['priority']['Removed'], ['P4'])
+        self.assertEqual(panel.get_enum_list(), self.new['priority'])
+
+    def test_table_stamp_sees_panel_edits(self):
+        """
+        the table stamp changes with the edits the admin panels make: a
+        value added, two values of the same length swapped and a component
+        owner replaced by one of the same length
+        """
+        from ticketfieldconfig.fingerprint import table_stamp
+
+        def stamp():
+            with self.env.db_query as db:
+                return table_stamp(db)
+
+        stamps = [stamp()]
+        panel = PriorityAdminPanel(self.env)
+        panel._do_add('P4')
+        stamps.append(stamp())
+        with self.env.db_transaction as db:
+            db("UPDATE enum SET value='4' WHERE type='priority' "
+               "AND name='major'")
+            db("UPDATE enum SET value='3' WHERE type='priority' "
+               "AND name='minor'")
+        stamps.append(stamp())
+        with self.env.db_transaction as db:
+            db("UPDATE component SET owner='everyone' "
+               "WHERE name='component1'")
+        stamps.append(stamp())
+
+        self.assertEqual(len(set(stamps)), 4)
+        self.assertEqual(stamp(), stamps[-1])
+
+    def test_swapped_positions_are_corrected(self):
+        """
+        swapping the positions of two values of the same length is seen by
+        the fingerprint and corrected on the next run
+        """
+        self.env.config.set('ticket-field-config', 'priority', 'P1,P2,P3')
+        admin_command = TicketFieldConfigCommand(self.env)
+        admin_command.apply_fields_from_config()
+
+        with self.env.db_transaction as db:
+            db("UPDATE enum SET value='2' WHERE type='priority' "
+               "AND name='P1'")
+            db("UPDATE enum SET value='1' WHERE type='priority' "
+               "AND name='P2'")
+
+        self.assertTrue(admin_command.apply_fields_from_config()['changed'])
+        self.assertEqual(PriorityAdminPanel(self.env).get_enum_list(),
+                         ['P1', 'P2', 'P3'])
+
+    def test_plan_does_not_alter_database(self):
+        """
+        a plan reports the changes an apply would make without writing them
+        """
+        self.env.config.set('ticket-field-config', 'priority',
+                            ','.join(self.new['priority']))
+        self.env.config.set('ticket-field-config', 'component',
+                            ','.join(self.new['component']))
+        self.env.config.set('ticket-field-config', 'component_owner', 'test')
+
+        admin_command = TicketFieldConfigCommand(self.env)
+        plan = admin_command.plan_fields_from_config()
+
+        # one query for the enum table and one for the component table
+        self.assertEqual(plan['statements'], 2)
+        self.assertEqual(PriorityAdminPanel(self.env).get_enum_list(),
+                         self.default['priority'])
+        self.assertItemsEqual(ComponentAdminPanel(self.env).get_component_list(),
+                              self.default['component'])
+
+        result = admin_command.apply_fields_from_config()
+        self.assertEqual(plan['comment'], result['comment'])
+
+    def test_bulk_component_bootstrap(self):
+        """
+        thousands of components are added with a single batched insert
+        """
+        components = ['generated/%04d' % i for i in range(5000)]
+        self.env.config.set('ticket-field-config', 'component',
+                            ','.join(components))
+        self.env.config.set('ticket-field-config', 'component_owner', 'test')
+
+        admin_command = TicketFieldConfigCommand(self.env)
+        result = admin_command.apply_fields_from_config(force=True)
+
+        # one read, one snapshot read, one delete and one insert batch, plus
+        # the fingerprint
+        self.assertEqual(result['statements'], 10)
+        self.assertItemsEqual(ComponentAdminPanel(self.env).get_component_list(),
+                              components)
+
+    def test_duplicate_values_are_trac_error(self):
+        """a value listed twice is rejected before anything is written"""
+        self.env.config.set('ticket-field-config', 'priority', 'P1,P2,P1')
+
+        admin_command = TicketFieldConfigCommand(self.env)
+        self.assertRaises(TracError, admin_command.set_fields_from_config)
+
+        self.assertEqual(PriorityAdminPanel(self.env).get_enum_list(),
+                         self.default['priority'])
+
+    def test_profile_reports_fields_and_phases(self):
+        """
+        profiling adds per field and per phase timings and statement counts
+        """
+        self.env.config.set('ticket-field-config', 'priority',
+                            ','.join(self.new['priority']))
+
+        admin_command = TicketFieldConfigCommand(self.env)
+        result = admin_command.apply_fields_from_config(profile=True)
+
+        profile = result['profile']
+        self.assertItemsEqual(profile.keys(), ['all', 'priority'])
+        self.assertItemsEqual(profile['priority'].keys(),
+                              ['rename', 'remove', 'add', 'update', 'reorder'])
+        self.assertEqual(profile['priority']['remove']['statements'], 1)
+        self.assertEqual(profile['priority']['reorder']['statements'], 0)
+        self.assertEqual(sum(phase['statements']
+                             for field in profile.values()
+                             for phase in field.values()),
+                         result['statements'])
+
+        result = admin_command.apply_fields_from_config()
+        self.assertFalse('profile' in result)
+
+        self.env.config.set('ticket-field-config', 'profile', 'true')
+        result = admin_command.apply_fields_from_config()
+        self.assertTrue('profile' in result)
+
+    def _insert_ticket(self, **values):
+        ticket = Ticket(self.env)
+        ticket['summary'] = 'test'
+        for name, value in values.items():
+            ticket[name] = value
+        return ticket.insert()
+
+    def test_rename_remaps_tickets(self):
+        """
+        a rename mapping renames the enum in place and moves its tickets
+        """
+        ids = [self._insert_ticket(priority='major') for i in range(3)]
+        other = self._insert_ticket(priority='minor')
+
+        self.env.config.set('ticket-field-config', 'priority',
+                            'blocker,critical,P2,minor,trivial')
+        self.env.config.set('ticket-field-config', 'priority_rename',
+                            'major:P2')
+
+        admin_command = TicketFieldConfigCommand(self.env)
+        result = admin_command.apply_fields_from_config()
+
+        self.assertEqual(result['comment']['priority'],
+                         {'Added': [], 'Removed': [], 'Reordered': None,
+                          'Renamed': {'major': 'P2'}})
+        self.assertEqual(PriorityAdminPanel(self.env).get_enum_list(),
+                         ['blocker', 'critical', 'P2', 'minor', 'trivial'])
+        for id in ids:
+            self.assertEqual(Ticket(self.env, id)['priority'], 'P2')
+        self.assertEqual(Ticket(self.env, other)['priority'], 'minor')
+
+        # the rename is a no-op once applied
+        result = admin_command.apply_fields_from_config(force=True)
+        self.assertFalse(result['changed'])
+
+    def test_rename_into_existing_value_with_history(self):
+        """
+        renaming onto a value that already exists merges the two and writes
+        ticket_change rows when rename_history is enabled
+        """
+        ids = [self._insert_ticket(type='defect') for i in range(2)]
+
+        self.env.config.set('ticket-field-config', 'ticket_type',
+                            'enhancement,task')
+        self.env.config.set('ticket-field-config', 'ticket_type_rename',
+                            'defect:task')
+        self.env.config.set('ticket-field-config', 'rename_history', 'true')
+
+        admin_command = TicketFieldConfigCommand(self.env)
+        admin_command.apply_fields_from_config()
+
+        self.assertEqual(TicketTypeAdminPanel(self.env).get_enum_list(),
+                         ['enhancement', 'task'])
+        for id in ids:
+            ticket = Ticket(self.env, id)
+            self.assertEqual(ticket['type'], 'task')
+            changes = [(field, old, new) for date, author, field, old, new,
+                       permanent in ticket.get_changelog()]
+            self.assertEqual(changes, [('type', 'defect', 'task')])
+
+    def test_invalid_rename_is_trac_error(self):
+        """a rename must be old:new and old must not be configured"""
+        self.env.config.set('ticket-field-config', 'priority', 'major,P2')
+        self.env.config.set('ticket-field-config', 'priority_rename',
+                            'major:P2')
+
+        admin_command = TicketFieldConfigCommand(self.env)
+        self.assertRaises(TracError, admin_command.set_fields_from_config)
 
+        self.env.config.set('ticket-field-config', 'priority', 'P2')
+        self.env.config.set('ticket-field-config', 'priority_rename', 'major')
+        self.assertRaises(TracError, admin_command.set_fields_from_config)
+
+    def test_rename_to_unlisted_value_is_trac_error(self):
+        """
+        the new value of a rename must be listed, or its tickets would be
+        left on a removed value
+        """
+        ticket_id = self._insert_ticket(priority='major')
+        self.env.config.set('ticket-field-config', 'priority', 'P1,P3')
+        self.env.config.set('ticket-field-config', 'priority_rename',
+                            'major:P2')
+
+        admin_command = TicketFieldConfigCommand(self.env)
+        self.assertRaises(TracError, admin_command.apply_fields_from_config)
+        self.assertEqual(PriorityAdminPanel(self.env).get_enum_list(),
+                         self.default['priority'])
+        self.assertEqual(Ticket(self.env, ticket_id)['priority'], 'major')
+
+    def test_chained_rename_is_trac_error(self):
+        """
+        a rename whose old value is the new value of another rename is
+        refused before anything is written, with or without history
+        """
+        ticket_id = self._insert_ticket(priority='major')
+        self.env.config.set('ticket-field-config', 'priority',
+                            'blocker,critical,P3,minor,trivial')
+        self.env.config.set('ticket-field-config', 'priority_rename',
+                            'major:P2,P2:P3')
+        self.env.config.set('ticket-field-config', 'rename_history', 'true')
+
+        admin_command = TicketFieldConfigCommand(self.env)
+        self.assertRaises(TracError, admin_command.apply_fields_from_config)
+        self.assertEqual(PriorityAdminPanel(self.env).get_enum_list(),
+                         self.default['priority'])
+        self.assertEqual(Ticket(self.env, ticket_id)['priority'], 'major')
+
+        # the final name works
+        self.env.config.set('ticket-field-config', 'priority_rename',
+                            'major:P3')
+        admin_command.apply_fields_from_config()
+        self.assertEqual(Ticket(self.env, ticket_id)['priority'], 'P3')
+
+    def test_refuse_if_used(self):
+        """
+        with refuse_if_used values still used by tickets are not removed
+        """
+        self._insert_ticket(priority='major')
+        self.env.config.set('ticket-field-config', 'priority',
+                            ','.join(self.new['priority']))
+
+        admin_command = TicketFieldConfigCommand(self.env)
+        self.assertRaises(TracError, admin_command.apply_fields_from_config,
+                          refuse_if_used=True)
+        self.assertRaises(TracError, admin_command.plan_fields_from_config,
+                          refuse_if_used=True)
+        self.assertEqual(PriorityAdminPanel(self.env).get_enum_list(),
+                         self.default['priority'])
+
+        # renaming the used value moves its tickets so it may be removed
+        self.env.config.set('ticket-field-config', 'priority_rename',
+                            'major:P2')
+        result = admin_command.apply_fields_from_config(refuse_if_used=True)
+        self.assertTrue(result['changed'])
+
+    def test_watch_applies_only_changed_fields(self):
+        """
+        watch mode applies everything once, then only the fields whose
+        options changed in the config
+        """
+        self.env.config.set('ticket-field-config', 'priority',
+                            ','.join(self.new['priority']))
+        self.env.config.set('ticket-field-config', 'severity',
+                            ','.join(self.new['severity']))
+
+        admin_command = TicketFieldConfigCommand(self.env)
+        applied = []
+        apply_fields_from_config = admin_command.apply_fields_from_config
+        def record(**kwargs):
+            applied.append(kwargs['fields'])
+            return apply_fields_from_config(**kwargs)
+        admin_command.apply_fields_from_config = record
+
+        env = self.env
+        class Watcher(object):
+            """stands in for trac.ini changing twice, then an interrupt"""
+            changes = [('severity', 'Low,High'), ('ticket_type', 'Bug')]
+            def wait(self):
+                if not self.changes:
+                    raise KeyboardInterrupt
+                env.config.set('ticket-field-config', *self.changes.pop(0))
+            def close(self):
+                pass
+
+        admin_command.watch_fields_from_config(watcher=Watcher())
+
+        self.assertEqual(applied, [None, ['severity'], ['ticket_type']])
+        self.assertEqual(SeverityAdminPanel(self.env).get_enum_list(),
+                         ['Low', 'High'])
+        self.assertEqual(TicketTypeAdminPanel(self.env).get_enum_list(),
+                         ['Bug'])
+
+    def _printed(self, command, *args):
+        stdout = sys.stdout
+        sys.stdout = StringIO()
+        try:
+            command(*args)
+            return json.loads(sys.stdout.getvalue())
+        finally:
+            sys.stdout = stdout
+
+    def test_snapshot_restore(self):
+        """
+        an apply saves the rows it changes to a snapshot, which restores
+        them in one go
+        """
+        self.env.db_transaction("""
+            UPDATE component SET description='first' WHERE name='component1'
+            """)
+        self.env.db_transaction("""
+            UPDATE enum SET description='usual' WHERE type='priority'
+            AND name='major'
+            """)
+        self.env.config.set('ticket-field-config', 'priority',
+                            ','.join(self.new['priority']))
+        self.env.config.set('ticket-field-config', 'component',
+                            ','.join(self.new['component']))
+        self.env.config.set('ticket-field-config', 'component_owner', 'test')
+
+        admin_command = TicketFieldConfigCommand(self.env)
+        result = admin_command.apply_fields_from_config()
+        self.assertEqual(self._printed(admin_command.list_fields_snapshots),
+                         [result['snapshot']])
+
+        restored = self._printed(admin_command.restore_fields_snapshot,
+                                 result['snapshot'])
+
+        self.assertEqual(restored['fields'], ['priority', 'component'])
+        self.assertEqual(PriorityAdminPanel(self.env).get_enum_list(),
+                         self.default['priority'])
+        self.assertEqual(sorted(self.env.db_query("""
+            SELECT name, owner, description FROM component
+            """)), [('component1', 'somebody', 'first'),
+                    ('component2', 'somebody', None)])
+        self.assertEqual(self.env.db_query("""
+            SELECT description FROM enum WHERE type='priority' AND name='major'
+            """), [('usual',)])
+
+    def test_snapshot_keep(self):
+        """
+        only the newest snapshot_keep snapshots are kept, 0 disables them
+        """
+        self.env.config.set('ticket-field-config', 'snapshot_keep', '2')
+        admin_command = TicketFieldConfigCommand(self.env)
+
+        ids = []
+        for priority in ('P1', 'P2', 'P3'):
+            self.env.config.set('ticket-field-config', 'priority', priority)
+            ids.append(admin_command.apply_fields_from_config()['snapshot'])
+        self.assertEqual(self._printed(admin_command.list_fields_snapshots),
+                         sorted(ids)[1:])
+
+        self.env.config.set('ticket-field-config', 'snapshot_keep', '0')
+        self.env.config.set('ticket-field-config', 'priority', 'P4')
+        self.assertNotIn('snapshot', admin_command.apply_fields_from_config())
+
+    def test_restore_unknown_snapshot(self):
+        """restoring a snapshot that does not exist raises TracError"""
+        admin_command = TicketFieldConfigCommand(self.env)
+        self.assertRaises(TracError, admin_command.restore_fields_snapshot,
+                          '../../conf/trac')
+
+    def _write_file(self, name, data):
+        path = os.path.join(self.env.path, name)
+        with open(path, 'w') as f:
+            f.write(data)
+        return path
+
+    def test_component_file(self):
+        """
+        components are read from a JSON Lines file, each with its own owner
+        or component_owner
+        """
+        path = self._write_file('components.jsonl',
+                                '{"name": "new/blog", "owner": "alice"}\n'
+                                '\n'
+                                '"new/site"\n')
+        self.env.config.set('ticket-field-config', 'component_file', path)
+        self.env.config.set('ticket-field-config', 'component_owner', 'test')
+
+        admin_command = TicketFieldConfigCommand(self.env)
+        admin_command.apply_fields_from_config()
+
+        self.assertEqual(sorted(self.env.db_query(
+            "SELECT name, owner FROM component")),
+            [('new/blog', 'alice'), ('new/site', 'test')])
+
+    def test_priority_csv_file(self):
+        """enum values are read from a CSV file in the listed order"""
+        path = self._write_file('priorities.csv', 'P1\nP2\n\nP3\n')
+        self.env.config.set('ticket-field-config', 'priority_file', path)
+
+        admin_command = TicketFieldConfigCommand(self.env)
+        admin_command.apply_fields_from_config()
+
+        self.assertEqual(PriorityAdminPanel(self.env).get_enum_list(),
+                         self.new['priority'])
+
+    def test_unchanged_file_not_parsed(self):
+        """
+        an unchanged value file is skipped by the fingerprint without being
+        parsed, a changed one is applied
+        """
+        path = self._write_file('priorities.csv', 'P1\nP2\n')
+        self.env.config.set('ticket-field-config', 'priority_file', path)
+
+        import ticketfieldconfig
+        admin_command = TicketFieldConfigCommand(self.env)
+        admin_command.apply_fields_from_config()
+
+        read_field_file = ticketfieldconfig.read_field_file
+        def fail(path):
+            raise AssertionError('value file parsed')
+        ticketfieldconfig.read_field_file = fail
+        try:
+            result = admin_command.apply_fields_from_config()
+        finally:
+            ticketfieldconfig.read_field_file = read_field_file
+        self.assertFalse(result['changed'])
+
+        self._write_file('priorities.csv', 'P2\nP1\n')
+        result = admin_command.apply_fields_from_config()
+        self.assertEqual(PriorityAdminPanel(self.env).get_enum_list(),
+                         ['P2', 'P1'])
+
+    def test_value_file_errors(self):
+        """
+        a field set both inline and from a file, a missing file and a
+        component without any owner raise TracError
+        """
+        admin_command = TicketFieldConfigCommand(self.env)
+        path = self._write_file('components.csv', 'new/blog\n')
+
+        self.env.config.set('ticket-field-config', 'component_file', path)
+        self.assertRaises(TracError, admin_command.apply_fields_from_config)
+
+        self.env.config.set('ticket-field-config', 'component_owner', 'test')
+        self.env.config.set('ticket-field-config', 'component', 'new/site')
+        self.assertRaises(TracError, admin_command.apply_fields_from_config)
+
+        self.env.config.remove('ticket-field-config', 'component')
+        self.env.config.set('ticket-field-config', 'component_file',
+                            path + '.missing.csv')
+        self.assertRaises(TracError, admin_command.apply_fields_from_config)
+
+    def test_component_owner_drift(self):
+        """
+        components whose owner differs from the config get the configured
+        owner with one UPDATE and are reported under 'Owner changed'
+        """
+        self.env.config.set('ticket-field-config', 'component',
+                            'component1,component2')
+        self.env.config.set('ticket-field-config', 'component_owner', 'test')
+
+        admin_command = TicketFieldConfigCommand(self.env)
+        result = admin_command.apply_fields_from_config(force=True,
+                                                        profile=True)
+
+        self.assertEqual(result['comment']['component']['Owner changed'],
+                         {'component1': ['somebody', 'test'],
+                          'component2': ['somebody', 'test']})
+        self.assertEqual(
+            result['profile']['component']['update']['statements'], 1)
+        self.assertEqual(sorted(self.env.db_query(
+            "SELECT name, owner FROM component")),
+            [('component1', 'test'), ('component2', 'test')])
+
+        result = admin_command.apply_fields_from_config(force=True)
+        self.assertFalse(result['changed'])
+
+    def test_field_drift(self):
+        """
+        drift compares the ordered values, and the component owners, of the
+        config with the database
+        """
+        self.env.config.set('ticket-field-config', 'priority',
+                            ','.join(reversed(self.default['priority'])))
+        self.env.config.set('ticket-field-config', 'component',
+                            ','.join(self.default['component']))
+        self.env.config.set('ticket-field-config', 'component_owner',
+                            'somebody')
+
+        admin_command = TicketFieldConfigCommand(self.env)
+        self.assertEqual(admin_command.get_field_drift(),
+                         {'priority': True, 'component': False})
+
+        self.env.config.set('ticket-field-config', 'component_owner', 'test')
+        admin_command.apply_fields_from_config()
+        self.assertEqual(admin_command.get_field_drift(),
+                         {'priority': False, 'component': False})
+
+    def test_one_field_cache_reset_per_apply(self):
+        """
+        an apply adding, removing, renaming, reordering and changing owners
+        across every field invalidates Trac's caches exactly once, after the
+        commit, and an apply changing nothing does not invalidate them
+        """
+        from trac.cache import CacheManager
+
+        for field_name in ('priority', 'severity', 'resolution', 'ticket_type',
+                           'component'):
+            self.env.config.set('ticket-field-config', field_name,
+                                ','.join(self.new[field_name]))
+        self.env.config.set('ticket-field-config', 'component_owner', 'test')
+        self.env.config.set('ticket-field-config', 'priority_rename',
+                            'major:P2')
+
+        invalidated = []
+        invalidate = CacheManager.invalidate
+        def record(cache_manager, id):
+            # the transaction is committed before the reset
+            self.assertEqual(PriorityAdminPanel(self.env).get_enum_list(),
+                             self.new['priority'])
+            invalidated.append(id)
+            return invalidate(cache_manager, id)
+        CacheManager.invalidate = record
+        try:
+            admin_command = TicketFieldConfigCommand(self.env)
+            result = admin_command.apply_fields_from_config()
+            self.assertTrue(result['changed'])
+            self.assertEqual(len(invalidated), 1)
+
+            admin_command.apply_fields_from_config(force=True)
+            self.assertEqual(len(invalidated), 1)
+        finally:
+            CacheManager.invalidate = invalidate
+
+    def test_milestone_and_version_sync(self):
+        """
+        milestones and versions are reconciled like components, with the
+        declared dates, in batches and reported by plan and apply
+        """
+        self.env.config.set('ticket-field-config', 'milestone',
+                            'milestone1,2026Q1,2026Q2')
+        self.env.config.set('ticket-field-config', 'milestone_due',
+                            '2026Q1:2026-03-31,2026Q2:2026-06-30')
+        self.env.config.set('ticket-field-config', 'milestone_completed',
+                            'milestone1:2026-01-02')
+        self.env.config.set('ticket-field-config', 'version', '1.0,3.0')
+        self.env.config.set('ticket-field-config', 'version_time',
+                            '3.0:2026-02-01')
+
+        admin_command = TicketFieldConfigCommand(self.env)
+        plan = admin_command.plan_fields_from_config()
+        result = admin_command.apply_fields_from_config(profile=True)
+
+        self.assertEqual(plan['comment'], result['comment'])
+        self.assertEqual(result['comment']['milestone']['Added'],
+                         ['2026Q1', '2026Q2'])
+        self.assertItemsEqual(result['comment']['milestone']['Removed'],
+                              ['milestone2', 'milestone3', 'milestone4'])
+        self.assertEqual(result['comment']['milestone']['Dates changed'],
+                         {'milestone1': [{'completed': None},
+                                         {'completed': '2026-01-02'}]})
+        self.assertEqual(result['comment']['version']['Added'], ['3.0'])
+        self.assertEqual(result['comment']['version']['Removed'], ['2.0'])
+        self.assertEqual(result['profile']['milestone']['add']['statements'],
+                         1)
+        self.assertEqual(
+            result['profile']['milestone']['update']['statements'], 1)
+
+        self.assertEqual(sorted(self.env.db_query(
+            "SELECT name, due, completed FROM milestone")),
+            [('2026Q1', 1774915200000000, 0), ('2026Q2', 1782777600000000, 0),
+             ('milestone1', 0, 1767312000000000)])
+        self.assertEqual(sorted(self.env.db_query(
+            "SELECT name, time FROM version")),
+            [('1.0', 0), ('3.0', 1769904000000000)])
+
+        self.assertFalse(admin_command.apply_fields_from_config(
+            force=True)['changed'])
+        self.assertEqual(admin_command.get_field_drift(),
+                         {'milestone': False, 'version': False})
+
+    def test_invalid_milestone_dates(self):
+        """
+        dates which are not YYYY-MM-DD, or for values which are not listed,
+        raise TracError
+        """
+        admin_command = TicketFieldConfigCommand(self.env)
+        self.env.config.set('ticket-field-config', 'milestone', '2026Q1')
+
+        self.env.config.set('ticket-field-config', 'milestone_due',
+                            '2026Q1:March')
+        self.assertRaises(TracError, admin_command.apply_fields_from_config)
+
+        self.env.config.set('ticket-field-config', 'milestone_due',
+                            '2026Q2:2026-06-30')
+        self.assertRaises(TracError, admin_command.apply_fields_from_config)
+
+    def test_custom_field_options_sync(self):
+        """
+        the options of [ticket-custom] select fields are diffed against
+        custom.<field>, written with a single save of trac.ini and renamed
+        options are remapped in ticket_custom
+        """
+        from trac.config import Configuration
+        from trac.ticket.api import TicketSystem
+
+        self.env.config.filename = os.path.join(self.env.path, 'trac.ini')
+        self.env.config.set('ticket-custom', 'os', 'select')
+        self.env.config.set('ticket-custom', 'os.options', '|linux|osx|win')
+        self.env.config.set('ticket-custom', 'arch', 'radio')
+        self.env.config.set('ticket-custom', 'arch.options', 'x86|arm')
+        TicketSystem(self.env).reset_ticket_fields()
+        ids = [self._insert_ticket(os='osx') for i in range(2)]
+        other = self._insert_ticket(os='win')
+
+        self.env.config.set('ticket-field-config', 'custom.os',
+                            'linux,macos,win')
+        self.env.config.set('ticket-field-config', 'custom.os_rename',
+                            'osx:macos')
+        self.env.config.set('ticket-field-config', 'custom.arch',
+                            'arm,x86,riscv')
+
+        saved = []
+        save = Configuration.save
+        def record(config):
+            saved.append(config.filename)
+            return save(config)
+        Configuration.save = record
+        try:
+            admin_command = TicketFieldConfigCommand(self.env)
+            plan = admin_command.plan_fields_from_config()
+            result = admin_command.apply_fields_from_config()
+            self.assertEqual(len(saved), 1)
+
+            # nothing left to write once the options are saved
+            self.assertFalse(admin_command.apply_fields_from_config()
+                             ['changed'])
+            self.assertFalse(admin_command.apply_fields_from_config(
+                force=True)['changed'])
+            self.assertEqual(len(saved), 1)
+        finally:
+            Configuration.save = save
+
+        self.assertEqual(plan['comment'], result['comment'])
+        self.assertEqual(result['comment']['custom.os'],
+                         {'Added': [], 'Removed': [], 'Reordered': None,
+                          'Renamed': {'osx': 'macos'}})
+        self.assertEqual(result['comment']['custom.arch'],
+                         {'Added': ['riscv'], 'Removed': [],
+                          'Reordered': ['x86']})
+
+        # the empty option keeping os optional is preserved
+        saved_config = Configuration(self.env.config.filename)
+        self.assertEqual(saved_config.get('ticket-custom', 'os.options'),
+                         '|linux|macos|win')
+        self.assertEqual(saved_config.get('ticket-custom', 'arch.options'),
+                         'arm|x86|riscv')
+        for id in ids:
+            self.assertEqual(Ticket(self.env, id)['os'], 'macos')
+        self.assertEqual(Ticket(self.env, other)['os'], 'win')
+        self.assertEqual(admin_command.get_field_drift(),
+                         {'custom.os': False, 'custom.arch': False})
+
+    def test_custom_field_without_options(self):
+        """
+        options set on a select field which has none yet do not make it
+        optional
+        """
+        self.env.config.filename = os.path.join(self.env.path, 'trac.ini')
+        self.env.config.set('ticket-custom', 'os', 'select')
+        self.env.config.set('ticket-field-config', 'custom.os', 'linux,win')
+
+        admin_command = TicketFieldConfigCommand(self.env)
+        result = admin_command.apply_fields_from_config()
+
+        self.assertEqual(result['comment']['custom.os']['Added'],
+                         ['linux', 'win'])
+        self.assertEqual(self.env.config.get('ticket-custom', 'os.options'),
+                         'linux|win')
+
+    def test_custom_field_errors(self):
+        """
+        custom.<field> must name a select or radio field, and removing an
+        option still used by tickets is refused with refuse_if_used
+        """
+        admin_command = TicketFieldConfigCommand(self.env)
+        self.env.config.set('ticket-field-config', 'custom.os', 'linux')
+        self.assertRaises(TracError, admin_command.apply_fields_from_config)
+
+        self.env.config.set('ticket-custom', 'os', 'text')
+        self.assertRaises(TracError, admin_command.apply_fields_from_config)
+
+        self.env.config.set('ticket-custom', 'os', 'select')
+        self.env.config.set('ticket-custom', 'os.options', 'linux|win')
+        from trac.ticket.api import TicketSystem
+        TicketSystem(self.env).reset_ticket_fields()
+        self._insert_ticket(os='win')
+        self.assertRaises(TracError, admin_command.apply_fields_from_config,
+                          refuse_if_used=True)
+        self.assertEqual(self.env.config.get('ticket-custom', 'os.options'),
+                         'linux|win')
+
+        # renames of custom fields must target a listed option too
+        self.env.config.set('ticket-field-config', 'custom.os_rename',
+                            'win:windows')
+        self.assertRaises(TracError, admin_command.apply_fields_from_config)
+
+    def test_milestones_visible_through_trac_model(self):
+        """
+        synced milestones are seen by Trac's Milestone model, whose cache is
+        reset, and the attachments of removed milestones are deleted
+        """
+        from trac.attachment import Attachment
+        from trac.resource import ResourceNotFound
+        from trac.ticket.model import Milestone
+
+        # fill the cache before the apply
+        self.assertItemsEqual([m.name for m in Milestone.select(self.env)],
+                              ['milestone1', 'milestone2', 'milestone3',
+                               'milestone4'])
+        attachment = Attachment(self.env, 'milestone', 'milestone2')
+        attachment.insert('notes.txt', StringIO(''), 0)
+
+        self.env.config.set('ticket-field-config', 'milestone',
+                            'milestone1,2026Q1')
+        self.env.config.set('ticket-field-config', 'milestone_due',
+                            '2026Q1:2026-03-31')
+        admin_command = TicketFieldConfigCommand(self.env)
+        admin_command.apply_fields_from_config()
+
+        self.assertItemsEqual([m.name for m in Milestone.select(self.env)],
+                              ['milestone1', '2026Q1'])
+        self.assertEqual(Milestone(self.env, '2026Q1').due.year, 2026)
+        self.assertRaises(ResourceNotFound, Milestone, self.env, 'milestone2')
+        self.assertEqual(list(Attachment.select(self.env, 'milestone',
+                                                'milestone2')), [])
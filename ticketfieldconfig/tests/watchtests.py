@@ -0,0 +1,50 @@
+#!/usr/bin/env python
+
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from ticketfieldconfig.watch import ConfigWatcher
+
+class ConfigWatcherTests(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'trac.ini')
+        self._write('[ticket-field-config]\n')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def _write(self, data):
+        # replace the file the way config management tools do
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w') as f:
+            f.write(data)
+        os.rename(tmp, self.path)
+
+    def _check_watcher(self, watcher):
+        try:
+            self.assertFalse(watcher.wait(timeout=0.1))
+
+            timer = threading.Timer(0.1, self._write,
+                                    ('[ticket-field-config]\npriority = P1\n',))
+            timer.start()
+            self.assertTrue(watcher.wait(timeout=5))
+            timer.join()
+
+            self.assertFalse(watcher.wait(timeout=0.1))
+        finally:
+            watcher.close()
+
+    def test_inotify_watcher(self):
+        """a replaced file is noticed through inotify where available"""
+        self._check_watcher(ConfigWatcher(self.path, interval=1))
+
+    def test_polling_watcher(self):
+        """without inotify the file is polled"""
+        watcher = ConfigWatcher(self.path, interval=0.05, use_inotify=False)
+        self.assertFalse(watcher.uses_inotify)
+        self._check_watcher(watcher)
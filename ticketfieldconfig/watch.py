@@ -0,0 +1,129 @@
+"""
+Wait for changes of the trac.ini file, used by
+'set fields from config --watch'.
+
+On Linux the directory holding the file is watched with inotify (through
+ctypes, so nothing needs installing) which also catches editors and config
+management tools replacing the file by a rename.  Elsewhere, or when
+inotify is not available, the modification time and size of the file are
+polled.
+"""
+
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import struct
+import time
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+
+# struct inotify_event header: wd, mask, cookie, len
+EVENT_HEADER = struct.Struct('iIII')
+
+
+def _file_state(path):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return (stat.st_mtime, stat.st_size, stat.st_ino)
+
+
+class ConfigWatcher(object):
+    """
+    Watch one file.  wait() blocks until the file changed since the
+    previous call (or since the watcher was created).
+    """
+
+    def __init__(self, path, interval=2.0, use_inotify=True):
+        self.path = os.path.abspath(path)
+        self.interval = interval
+        self.state = _file_state(self.path)
+        self.fd = self._init_inotify() if use_inotify else None
+
+    def _init_inotify(self):
+        name = ctypes.util.find_library('c')
+        if not name:
+            return None
+        try:
+            libc = ctypes.CDLL(name, use_errno=True)
+            fd = libc.inotify_init()
+        except (OSError, AttributeError):
+            return None
+        if fd < 0:
+            return None
+
+        # not IN_MODIFY, the file is only read once the writer is done
+        mask = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+        directory = os.path.dirname(self.path).encode('utf-8')
+        if libc.inotify_add_watch(fd, directory, mask) < 0:
+            os.close(fd)
+            return None
+        return fd
+
+    @property
+    def uses_inotify(self):
+        return self.fd is not None
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+    def _read_events(self, timeout):
+        """
+        Wait up to timeout seconds for inotify events and return whether
+        any of them concerned the watched file.
+        """
+        try:
+            readable = select.select([self.fd], [], [], timeout)[0]
+        except (select.error, OSError) as e:
+            if e.args[0] == errno.EINTR:
+                return False
+            raise
+        if not readable:
+            return False
+
+        data = os.read(self.fd, 64 * 1024)
+        basename = os.path.basename(self.path).encode('utf-8')
+        offset = 0
+        touched = False
+        while offset + EVENT_HEADER.size <= len(data):
+            wd, mask, cookie, length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = data[offset:offset + length].rstrip(b'\0')
+            offset += length
+            if name == basename:
+                touched = True
+        return touched
+
+    def wait(self, timeout=None):
+        """
+        Block until the file changed, returns False if timeout seconds
+        passed without a change.
+        """
+        deadline = None if timeout is None else time.time() + timeout
+
+        while True:
+            remaining = self.interval
+            if deadline is not None:
+                remaining = min(remaining, max(0, deadline - time.time()))
+
+            touched = False
+            if self.fd is not None:
+                touched = self._read_events(remaining)
+            else:
+                time.sleep(remaining)
+
+            # the file state is checked with inotify too, in case events
+            # were missed, e.g. when the directory itself was replaced
+            state = _file_state(self.path)
+            if touched or state != self.state:
+                self.state = state
+                return True
+            if deadline is not None and time.time() >= deadline:
+                return False